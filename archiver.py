@@ -16,14 +16,19 @@ PATCH_SERVICE = 'ted@tedm.io:/var/www/binary_builds/patches/'
 
 
 def CollectIssues(branch:libgit.Branch) -> [str]:
-  if branch.Name() == 'main':
-    return []
-  result = CollectIssues(branch.Parent())
-  try:
-    result.append(getattr(branch, 'gerritissue', ''))
-  except:
-    pass
-  return result
+  # The snapshot answers every Parent() and gerritissue lookup up the stack
+  # without spawning git for each branch.
+  libgit.Branch.LoadSnapshot()
+  result = []
+  seen = set()
+  while branch and branch.Name() != 'main' and branch.Name() not in seen:
+    seen.add(branch.Name())
+    try:
+      result.append(getattr(branch, 'gerritissue', ''))
+    except:
+      pass
+    branch = branch.Parent()
+  return result[::-1]
 
 
 def GenerateDiffAndHash() -> (str, str):
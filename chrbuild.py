@@ -7,10 +7,12 @@ import sys
 import subprocess
 import os
 import shutil
-import re
-import requests
 from urllib.parse import urlparse
 
+from lib import libbuildbucket
+from lib import libmb
+from lib import libninja
+
 
 CONFIG = {}
 
@@ -67,14 +69,6 @@ def EnsurePython():
   os.system('python --version')
 
 
-def RunCommand(command, stream_stdout=False):
-  return subprocess.run(command,
-                        encoding='utf-8',
-                        shell=True,
-                        stderr=subprocess.PIPE,
-                        stdout=(None if stream_stdout else subprocess.PIPE))
-
-
 class Complete():
   """Auto complet generator."""
   def __init__(self):
@@ -146,12 +140,14 @@ class Build():
       'ffmpeg_branding': '"ChromeOS"'
     }
 
-  def __init__(self, target='chrome', base='Default', gn_args=None, j=1000):
+  def __init__(self, target='chrome', base='Default', gn_args=None, j=1000,
+               prune_unknown=False):
     self.target = target
     self.base = base
     self.gn_args = self.default_args()
     self.gn_args.update(gn_args or {})
     self.j = j
+    self.prune_unknown = prune_unknown
 
   def args(self):
     return '\n'.join('{}={}'.format(k,v) for k,v in self.gn_args.items() if v != None)
@@ -159,12 +155,20 @@ class Build():
   def run(self, *args, **kwargs):
     if not os.path.isdir('{}/out/{}'.format(CONFIG['src_directory'], self.base)):
       os.system('gn gen out/{} --check --args=\'{}\''.format(self.base, self.args()))
-    # TODO: return the stdout here!
     self.__dict__.update(kwargs)
-    ninja = f'ninja -C out/{self.base} {self.target} -j{self.j}'
-    print(ninja)
-    res = RunCommand(ninja, stream_stdout=True)
-    return res
+    outdir = f'out/{self.base}'
+    targets = self.target.split()
+    if self.prune_unknown:
+      targets, unknown = libninja.ResolveTargets(outdir, targets)
+      for target in unknown:
+        print(f'Invalid target: {target} --- skipping it')
+      if not targets:
+        raise ValueError(f'None of the targets exist in {outdir}')
+    print(f'ninja -C {outdir} {" ".join(targets)} -j{self.j}')
+    telemetry = os.path.join(outdir, libninja.TELEMETRY_LOG)
+    with libninja.TelemetryLog(telemetry) as log:
+      return libninja.Run(outdir, targets, self.j,
+                          listeners=[libninja.ProgressDisplay(), log])
 
 
 
@@ -177,123 +181,63 @@ class NoBuild(Build):
 
 
 
-RPC = 'https://cr-buildbucket.appspot.com/prpc/buildbucket.v2.Builds/GetBuild'
-FMT = r'https://ci\.chromium\.org/ui/p/(\S+)/builders/(\S+)/(\S+)/([b]*[0-9]+)'
-PARSER = re.compile(FMT)
-
-def get_request_payload(url):
-  try:
-    groups = PARSER.match(url).groups()
-    return {
-      'builder': {
-        'project': groups[0],
-        'bucket': groups[1],
-        'builder': groups[2],
-      },
-      'buildNumber': groups[3],
-      'fields': 'steps,id'
-    }
-  except AttributeError:
-    raise ValueError(f'{FMT} could not match {url}')
-
 class BuildbotEntries(object):
   def __init__(self, url):
+    self._url = url
     self._compile_targets = []
     self._gn_args = {}
-    q = requests.post(
-      url=RPC,
-      data=json.dumps(get_request_payload(url)),
-      headers={
-        'content-type': 'application/json',
-        'accept': 'application/json'
-      })
-    if q.status_code != 200:
-      raise ValueError(f'RPC to {RPC} failed')
-      self._json = {}
-    else:
-      self._json = json.loads(q.text[5:])
+    self._json = None
+
+  def _Json(self):
+    if self._json is None:
+      self._json = libbuildbucket.Call(
+        'GetBuild', libbuildbucket.BuildRequestFromUrl(self._url))
+    return self._json
 
   def GetCompileTargets(self):
     if self._compile_targets:
       return self._compile_targets
-    for step in self._json.get('steps', []):
+    for step in self._Json().get('steps', []):
       if step['name'] == 'generate_build_files (with patch)':
         for log in step.get('logs', []):
           if log['name'] == 'swarming-targets-file.txt':
-            return self._GetCompileTargetsFromTargetsFileUrl(
-              log['viewUrl']+'?format=raw')
+            return self._GetCompileTargetsFromTargetsFileUrl(log['viewUrl'])
     return ['all']
 
   def _GetCompileTargetsFromTargetsFileUrl(self, url):
-    return str(requests.get(url).content)[2:-1].strip().split('\\n')[:-1]
+    return [line.strip() for line in libbuildbucket.StreamLog(url)
+            if line.strip()]
 
   def _GetCompileTargetsFromURL(self, url):
-    stdout = str(requests.get(url).content).split('\\n')
-    targets = []
-    found_targets = 2
-    index = 0
-    while found_targets:
-      if stdout[index] == ' &#39;-j&#39;,' and found_targets == 2:
-        found_targets = 1
-      elif found_targets == 1:
-        line = stdout[index].strip().replace('&#39;', '\'')
-        find = re.search(r'\'([a-zA-Z:/_]+)\'', line)
-        if find:
-          targets.append(find.group(1))
-        if line.endswith(']'):
-          found_targets = 0
-      index += 1
-    self._compile_targets = targets
-    return targets
+    self._compile_targets = libbuildbucket.GetCompileTargets(url)
+    return self._compile_targets
 
   def GetGNArgs(self):
     if self._gn_args:
       return self._gn_args
-    for step in self._json.get('steps', []):
+    match = libbuildbucket.BUILDER_URL_REGEX.match(self._url)
+    if match:
+      master, builder = libmb.GetLookupFlags(
+        '/'.join(match.groups()[:3]), self._GetLookupFlags)
+    else:
+      master, builder = self._GetLookupFlags()
+    print(master, builder)
+    try:
+      self._gn_args = libmb.LookupGNArgs(master, builder)
+      return self._gn_args
+    except ValueError as e:
+      print(e)
+      exit()
+
+  def _GetLookupFlags(self):
+    for step in self._Json().get('steps', []):
       if step['name'] == 'compilator steps (with patch)|lookup GN args':
         for log in step.get('logs', []):
           if log['name'] == 'execution details':
-            return self._GetGnArgsFromURL(log['viewUrl'])
+            return libbuildbucket.GetMbLookupFlags(log['viewUrl'])
         raise ValueError('Could not get \'logs\' json entry for gn args')
     raise ValueError(f'Could Not Find GN Args')
 
-  def _GetGnArgsFromURL(self, url):
-    master = ''
-    builder = ''
-    cmd = str(requests.get(url+'?format=raw').content, 'utf-8').split('\n')
-    if (cmd[0]) != 'Executing command [':
-      raise ValueError(f'Could not get command from {url}')
-
-    def yield_until_closebracket():
-      for line in cmd[1:]:
-        if line.strip() == ']':
-          return
-        yield line.strip()[1:-2]
-
-    cmd = list(yield_until_closebracket())
-    for i, arg in enumerate(cmd):
-      if arg == "-m":
-        master = cmd[i+1]
-      if arg == "-b":
-        builder = cmd[i+1]
-
-      if master and builder:
-        print(master, builder)
-        command = './tools/mb/mb.py lookup -m {} -b {} --quiet'
-        try:
-          import subprocess
-          stdout = subprocess.check_output(
-            command.format(master, builder), shell=True)
-          for entry in str(stdout, 'utf-8').split('\n'):
-            _e = entry.split(' = ')
-            if entry:
-              self._gn_args[_e[0]] = _e[1]
-          return self._gn_args
-        except:
-          print("Can't get gn args because the command fails:")
-          print(command.format(master, builder))
-          exit()
-
 
 class MultiBuild():
   def __init__(self, targets, together=False):
@@ -309,23 +253,19 @@ class MultiBuild():
       self._run_apart(*args, **kwargs)
 
   def _run_together(self, *args, **kwargs):
+    # Unknown targets are dropped before ninja starts, so the build graph is
+    # only loaded once no matter how many of them there are.
     target = ' '.join(self.targets)
     x = complete.run_func(lambda:{
         'func': goma_build(lambda *args: Build(
           target=target,
           base=self.base,
           gn_args=self.gn_args,
-          j=getattr(self, 'j', 1000)))
+          j=getattr(self, 'j', 1000),
+          prune_unknown=True))
     }, target, [], {})
-    if x.returncode == 1:
-      if x.stderr.startswith('ninja: error: unknown target'):
-        drop = x.stderr[30:-2]
-        print(f'Invalid target: {drop} --- retrying without it')
-        self.targets = set(self.targets)
-        self.targets.remove(drop)
-        self._run_together(*args, **kwargs)
-      else:
-        print(x.stderr)
+    if x.returncode:
+      print(x.stderr)
 
   def _run_apart(self, *args, **kwargs):
     total = len(self.targets)
@@ -643,6 +583,28 @@ def update():
   if branch != 'master':
     os.system('git checkout %s' % branch)
 
+@complete('ninjalog', 'report where a build spent its time: '
+          'ninjalog <out dir> [<baseline .ninja_log>] [-top=N] [-trace=<json>]')
+def ninjalog(outdir, baseline=None, top=20, trace=None):
+  def _Read(path):
+    if os.path.isdir(path):
+      path = os.path.join(path, libninja.NINJA_LOG)
+    elif not os.path.exists(path):
+      path = os.path.join('out', path, libninja.NINJA_LOG)
+    return libninja.NinjaLog.Read(path)
+
+  log = _Read(outdir)
+  for line in libninja.Report(log, int(top)):
+    print(line)
+  if baseline:
+    print()
+    for line in libninja.CompareReport(_Read(baseline), log, int(top)):
+      print(line)
+  if trace:
+    with open(trace, 'w') as f:
+      json.dump({'traceEvents': log.TraceEvents()}, f)
+    print(f'\nWrote {trace}, open it in about://tracing')
+
 @complete('clusterfuzz', 'run a clusterfuzz!')
 def clusterfuzz(*args):
   CF_BINARY = '/google/data/ro/teams/clusterfuzz-tools/releases/clusterfuzz'
@@ -2,7 +2,7 @@
 
 import sys
 
-from lib import libargs, librun, libgerrit, libgit, liboutput, colors
+from lib import libargs, librun, libgerrit, libgit, libhttp, liboutput, colors
 
 
 CURRENT_BRANCH = None
@@ -22,11 +22,28 @@ def display_help():
   print('  branch.merged')
 
 
-def get_branch_status(issue_number):
-  return f'<{libgerrit.GetReviewDetail(issue_number).status}>'
+def get_branch_issues():
+  issues = {}
+  for branch in libgit.Branch.GetAllBranches():
+    try:
+      issue = getattr(branch, 'gerritissue', '')
+    except:
+      continue
+    if issue:
+      issues[branch.Name()] = issue
+  return issues
 
 
-def disp_branch(highlight, nogerrit, quick):
+def get_branch_statuses(issues):
+  changes = libgerrit.QueryChanges(issues.values(), fields=('status',))
+  statuses = {}
+  for branch, issue in issues.items():
+    change = changes.get(str(issue))
+    statuses[branch] = f'<{change.status if change else "UNKNOWN"}>'
+  return statuses
+
+
+def disp_branch(highlight, nogerrit, quick, ahead_behind, statuses):
   def _inner(branch):
     color = ''
 
@@ -52,7 +69,7 @@ def disp_branch(highlight, nogerrit, quick):
 
     suffix = ''
     if issue_number:
-      status = get_branch_status(issue_number)
+      status = statuses.get(branch.Name(), '<UNKNOWN>')
       suffix = f' [https://crrev.com/c/{issue_number}] {status}'
 
     if suffix.endswith('<MERGED>'):
@@ -66,7 +83,10 @@ def disp_branch(highlight, nogerrit, quick):
     if suffix.endswith('<NEW>'):
       suffix = f'{colors.Color(colors.YELLOW)}{suffix}{colors.Color()}'
 
-    branch_ahead, branch_behind = branch.GetAheadBehind()
+    if branch.Name() in ahead_behind:
+      branch_ahead, branch_behind = ahead_behind[branch.Name()]
+    else:
+      branch_ahead, branch_behind = branch.GetAheadBehind()
 
     prefix = f' ↑{branch_ahead} ↓{branch_behind}'
     if (branch.Name() == 'main'):
@@ -79,20 +99,30 @@ def disp_branch(highlight, nogerrit, quick):
 @COMMAND
 def print_tree(highlight:str='branch.current',
                nogerrit:bool=False,
-               quick:bool=False):
+               quick:bool=False,
+               nocache:bool=False):
   if highlight == 'help':
     display_help()
     return
 
+  if nocache:
+    libhttp.Configure(cache=False)
+
   setup()
   main = libgit.Branch.Get('main')
   export = ['']
+  ahead_behind = {} if quick else libgit.Branch.GetAllAheadBehind()
+  statuses = {}
+  if not quick and not nogerrit:
+    libgit.Branch.LoadSnapshot()
+    statuses = get_branch_statuses(get_branch_issues())
 
   def _print_to_buffer(s, _, capture=export):
     capture[0] += f'{s}\n'
 
   liboutput.PrintTree(main,
-    render=disp_branch(highlight=highlight, nogerrit=nogerrit, quick=quick),
+    render=disp_branch(highlight=highlight, nogerrit=nogerrit, quick=quick,
+                       ahead_behind=ahead_behind, statuses=statuses),
     charset=liboutput.BOLD_BOX_CHARACTERS,
     output_function=_print_to_buffer,
     child_iterator=lambda b:b.Children())
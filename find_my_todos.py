@@ -1,72 +1,263 @@
 #!/usr/bin/env python3
 
-import json
+import mmap
 import os
+import struct
 import sys
 
+from lib import libcache
 from lib import librun
 
 def get_cache(filename):
-  home = os.environ['HOME']
-  directory = os.path.join(home, '.cache', 'chromium-src')
-  if not os.path.exists(directory):
-    os.system(f'mkdir {directory}')
-  return os.path.join(directory, filename)
-
-
-def needs_update(files):
-  cache = get_cache('files')
-  if not os.path.exists(cache):
-    return True
-  files = set(files)
-  with open(cache) as f:
+  return os.path.join(libcache.Directory(), filename)
+
+
+class TodoIndex(object):
+  """Append-only log of blamed TODO lines, one record per file.
+
+  The file starts with MAGIC and is followed by length-prefixed records:
+    RECORD  (payload length, flags)
+    path    (length, utf-8 bytes)
+    blob    (length, raw sha bytes; empty for files with unstaged changes)
+    count   then `count` x LINE (line, author-time, author len, text len)
+            each followed by the author and text bytes.
+  A later record for a path supersedes earlier ones, and a record with
+  TOMBSTONE set deletes the path. Load() only reads the path and blob of
+  each record, so the TODO lines themselves stay on disk until Read().
+  """
+  MAGIC = b'TODOIDX1'
+  RECORD = struct.Struct('<IB')
+  LENGTH = struct.Struct('<H')
+  BLOB = struct.Struct('<B')
+  COUNT = struct.Struct('<I')
+  LINE = struct.Struct('<IQHI')
+  TOMBSTONE = 1
+
+  def __init__(self, path):
+    self._path = path
+    self._live = {}
+    self._records = 0
+    self._end = len(self.MAGIC)
+
+  def _Map(self):
     try:
-      prefiles = set(json.loads(f.read()).keys())
-      return len(files - prefiles)
-    except:
-      return True
-
-
-def update(files, username):
-  with open(get_cache('files'), 'w') as f:
-    output = {f:{'user':[], 'bug':[]} for f in files}
-    for file in files:
-      print(f'blaming {file}')
-      output[file]['user'], output[file]['bug'] = blame_file(file, username)
-    f.write(json.dumps(output))
-
-
-def blame_file(filename, searchname):
-  buglines = []
-  userlines = []
-  for blameline in librun.OutputOrError(f'git blame {filename}').split('\n'):
-    if f'TODO({searchname})' in blameline:
-      userlines.append(blameline)
-    elif 'TODO(b/' in blameline:
-      buglines.append(blameline)
-  return userlines, buglines
-
-
-def display_todo(file, data):
-  if not data['user']:
+      with open(self._path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= len(self.MAGIC):
+          return None
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError:
+      return None
+    if data[:len(self.MAGIC)] != self.MAGIC:
+      data.close()
+      return None
+    return data
+
+  def _Records(self, data):
+    offset = len(self.MAGIC)
+    while offset + self.RECORD.size <= len(data):
+      length, flags = self.RECORD.unpack_from(data, offset)
+      start = offset + self.RECORD.size
+      if start + length > len(data):
+        return
+      yield offset, flags, start
+      offset = start + length
+
+  def _ReadHeader(self, data, offset):
+    pathlen, = self.LENGTH.unpack_from(data, offset)
+    offset += self.LENGTH.size
+    path = data[offset:offset+pathlen].decode('utf-8')
+    offset += pathlen
+    bloblen, = self.BLOB.unpack_from(data, offset)
+    offset += self.BLOB.size
+    blob = data[offset:offset+bloblen].hex() or None
+    return path, blob, offset + bloblen
+
+  def Load(self):
+    """Scans the log and returns {path: blob} for every live record."""
+    self._live = {}
+    self._records = 0
+    self._end = len(self.MAGIC)
+    data = self._Map()
+    if data is None:
+      return {}
+    with data:
+      for offset, flags, start in self._Records(data):
+        path, blob, _ = self._ReadHeader(data, start)
+        if flags & self.TOMBSTONE:
+          self._live.pop(path, None)
+        else:
+          self._live[path] = (blob, offset)
+        self._records += 1
+        self._end = start + self.RECORD.unpack_from(data, offset)[0]
+    return {path: blob for path, (blob, _) in self._live.items()}
+
+  def _Encode(self, path, blob, lines, flags):
+    path = path.encode('utf-8')
+    blob = bytes.fromhex(blob) if blob else b''
+    parts = [self.LENGTH.pack(len(path)), path,
+             self.BLOB.pack(len(blob)), blob,
+             self.COUNT.pack(len(lines))]
+    for line in lines:
+      author = line['author'].encode('utf-8')[:0xffff]
+      text = line['text'].encode('utf-8')
+      parts.append(self.LINE.pack(
+        line['line'], line['time'], len(author), len(text)))
+      parts.append(author)
+      parts.append(text)
+    payload = b''.join(parts)
+    return self.RECORD.pack(len(payload), flags) + payload
+
+  def Write(self, updates, removed):
+    """Appends records for |updates| {path: (blob, lines)} and |removed|."""
+    if not updates and not removed:
+      return
+    mode = 'r+b' if os.path.exists(self._path) and self._records else 'wb'
+    with open(self._path, mode) as f:
+      if mode == 'wb':
+        f.write(self.MAGIC)
+      f.seek(self._end)
+      f.truncate()
+      for path, (blob, lines) in updates.items():
+        self._live[path] = (blob, f.tell())
+        f.write(self._Encode(path, blob, lines, 0))
+      for path in removed:
+        self._live.pop(path, None)
+        f.write(self._Encode(path, None, [], self.TOMBSTONE))
+      self._records += len(updates) + len(removed)
+      self._end = f.tell()
+
+  def NeedsCompaction(self):
+    return self._records > 2 * len(self._live) + 64
+
+  def Compact(self):
+    """Rewrites the log with only the live record for each path."""
+    data = self._Map()
+    if data is None:
+      return
+    with data, open(f'{self._path}.tmp', 'wb') as f:
+      f.write(self.MAGIC)
+      live = {}
+      for path, (blob, offset) in self._live.items():
+        length, _ = self.RECORD.unpack_from(data, offset)
+        live[path] = (blob, f.tell())
+        f.write(data[offset:offset+self.RECORD.size+length])
+    os.replace(f'{self._path}.tmp', self._path)
+    self._live = live
+    self._records = len(live)
+    self._end = os.path.getsize(self._path)
+
+  def Read(self):
+    """Yields (path, lines) for every live record, streaming from disk."""
+    data = self._Map()
+    if data is None:
+      return
+    with data:
+      for offset, flags, start in self._Records(data):
+        path, _, cursor = self._ReadHeader(data, start)
+        if flags & self.TOMBSTONE or self._live.get(path, (0, -1))[1] != offset:
+          continue
+        count, = self.COUNT.unpack_from(data, cursor)
+        cursor += self.COUNT.size
+        lines = []
+        for _ in range(count):
+          line, time, authorlen, textlen = self.LINE.unpack_from(data, cursor)
+          cursor += self.LINE.size
+          author = data[cursor:cursor+authorlen].decode('utf-8', 'replace')
+          cursor += authorlen
+          text = data[cursor:cursor+textlen].decode('utf-8', 'replace')
+          cursor += textlen
+          lines.append(
+            {'line': line, 'author': author, 'time': time, 'text': text})
+        yield path, lines
+
+
+def get_blobs(files):
+  """Maps each file to its blob sha, or None if it has unstaged changes."""
+  blobs = {}
+  for entry in librun.GitOutputOrError('ls-files', '-s', '-z').split('\0'):
+    if entry:
+      info, path = entry.split('\t', 1)
+      blobs[path] = info.split()[1]
+  for path in librun.GitOutputOrError('ls-files', '-m', '-z').split('\0'):
+    blobs[path] = None
+  return {f: blobs.get(f) for f in files}
+
+
+def grep_todo_lines():
+  """Maps each file containing `TODO(` to the line numbers it appears on."""
+  # -I skips binary files, which only get a 'Binary file X matches' line.
+  result = librun.RunGit('grep', '-I', '-n', '-z', '-F', 'TODO(')
+  if result.returncode > 1:
+    raise ValueError(f'|git grep|:\n {result.stderr}')
+  lines = {}
+  for entry in result.stdout.split('\n'):
+    if entry:
+      file, lineno, _ = entry.split('\0', 2)
+      lines.setdefault(file, []).append(int(lineno))
+  return lines
+
+
+def update(index, todo_lines):
+  cached = index.Load()
+  blobs = get_blobs(todo_lines)
+  stale = [f for f in todo_lines if not blobs[f] or cached.get(f) != blobs[f]]
+  commands = []
+  for file in stale:
+    ranges = [f'-L{n},{n}' for n in todo_lines[file]]
+    commands.append(['git', 'blame', '--porcelain', *ranges, '--', file])
+  updates = {}
+  for file, blame in zip(stale, librun.RunMany(commands)):
+    print(f'blaming {file}')
+    if blame.returncode:
+      raise ValueError(f'|git blame {file}|:\n {blame.stderr}')
+    updates[file] = (blobs[file], parse_porcelain(blame.stdout))
+  index.Write(updates, [f for f in cached if f not in todo_lines])
+  if index.NeedsCompaction():
+    index.Compact()
+
+
+def parse_porcelain(blame):
+  """Parses `git blame --porcelain` into [{line, author, time, text}]."""
+  commits = {}
+  lines = []
+  current = None
+  for line in blame.split('\n'):
+    if current is None:
+      if not line:
+        continue
+      sha, _, final = line.split(' ')[:3]
+      current = commits.setdefault(sha, {})
+      current['line'] = int(final)
+    elif line.startswith('\t'):
+      lines.append({
+        'line': current['line'],
+        'author': current.get('author', ''),
+        'time': int(current.get('author-time', 0)),
+        'text': line[1:],
+      })
+      current = None
+    else:
+      key, _, value = line.partition(' ')
+      current[key] = value
+  return sorted(lines, key=lambda l: l['line'])
+
+
+def display_todo(file, lines, username):
+  userlines = [l for l in lines if f'TODO({username})' in l['text']]
+  if not userlines:
     return
 
   print(file)
-  for line in data['user']:
-    num_cont = line.split('+0000')[1].strip()
-    num, cont = num_cont.split(')', 1)
-    print(f'  {num}: {cont.strip()}')
+  for line in userlines:
+    print(f'  {line["line"]}: {line["text"].strip()}')
 
 
 def grep_4_todo(username):
-  files = librun.OutputOrError('git grep -l TODO').split('\n')
-  if needs_update(files):
-    update(files, username)
-  cache = get_cache('files')
-  with open(cache) as f:
-    for file, data in json.loads(f.read()).items():
-      display_todo(file, data)
+  index = TodoIndex(get_cache('todo-index'))
+  update(index, grep_todo_lines())
+  for file, lines in index.Read():
+    display_todo(file, lines, username)
 
 
 if __name__ == '__main__':
-  grep_4_todo(sys.argv[1] if len(sys.argv) >= 2 else 'tmathmeyer')
\ No newline at end of file
+  grep_4_todo(sys.argv[1] if len(sys.argv) >= 2 else 'tmathmeyer')
@@ -6,7 +6,9 @@ import threading
 import time
 
 from lib import libpyterm as UI
+from lib import libbuildbucket
 from lib import libgerrit
+from lib import libhttp
 from lib import librun
 
 
@@ -45,19 +47,18 @@ class CRTryjobs(UI.NormalWindow):
     super().__init__(bordered=True)
     self.tryjobs = {}
     self.setupthread = None
+    self.poller = None
     self.errmsg = 'Pending CQ Query'
 
-  def BotQuery(self, buildername, terminal):
-    try:
-      boturl = self.tryjobs[buildername]['url']
-      status = libgerrit.GetBuildbotData(boturl, fields='status').status
-      self.tryjobs[buildername]['status'] = status
-    except Exception as e:
-      self.tryjobs[buildername]['status'] = 'ERROR'
-    terminal.PaintWindow(self)
+  def OnTryjobsChanged(self, terminal, tryjobs, changed):
+    self.tryjobs = tryjobs
+    terminal.PaintWindow(self, [tryjobs[bot]['line'] + 1 for bot in changed])
 
   def OnKey(self, keycode):
     if keycode == ord('t'):
+      if self.poller:
+        self.poller.Wake()
+        return False
       self.setupthread = None
       return True
     return False
@@ -77,23 +78,6 @@ class CRTryjobs(UI.NormalWindow):
       return context.colors.GetColor('BLACK', 'CYAN')
     return context.colors.GetColor()
 
-  def GetTryjobsList(self, cq, context):
-    for result in cq.results[::-1]:
-      try:
-        for idx, p in enumerate(result.fields.jobs.JOB_PENDING):
-          self.tryjobs[p.builder] = {
-            'url': p.url,
-            'name': p.builder,
-            'line': idx,
-            'status': 'UNKNOWN',
-            'thread': threading.Thread(
-              target=self.BotQuery, args=(p.builder, context.terminal))
-          }
-          self.tryjobs[p.builder]['thread'].start()
-        return
-      except:
-        continue
-
   def RepaintInitial(self, context):
     try:
       revision = context.cr.revisions[context.cr.current_revision]
@@ -111,9 +95,24 @@ class CRTryjobs(UI.NormalWindow):
       self.errmsg = 'No CQ Started'
       context.terminal.PaintWindow(self)
       return
-    self.GetTryjobsList(cq, context)
+    self.poller = TryjobPoller(
+      context.crnumber, revision._number,
+      lambda tryjobs, changed: self.OnTryjobsChanged(
+        context.terminal, tryjobs, changed))
+    self.poller.Update(GetTryjobUrls(cq))
+    self.tryjobs = self.poller.tryjobs
     self.setupthread = 'Finished'
     context.terminal.PaintWindow(self)
+    self.poller.Start()
+
+  def RepaintRow(self, context, row):
+    if self.setupthread != 'Finished' or not self.tryjobs:
+      return False
+    for data in self.tryjobs.values():
+      if data['line'] + 1 == row and row < self.Height():
+        self.WriteString(1, row, data['name'], self.ColorForStatus(
+          context, data['status']))
+    return True
 
   def Repaint(self, context):
     if self.setupthread is None:
@@ -137,78 +136,149 @@ class CRTryjobs(UI.NormalWindow):
       self.WriteString(1, 1, self.errmsg)
 
 
+class TryjobPoller(object):
+  """Keeps a change's tryjob statuses up to date from a background thread.
+
+  CQ is polled every POLL_INTERVAL seconds while any tryjob is still
+  running. Once they've all finished the interval doubles after every
+  quiet poll, up to IDLE_POLL_INTERVAL, and goes back to POLL_INTERVAL as
+  soon as anything changes. Finished builds are never queried again.
+
+  Every poll builds a new {builder: tryjob} snapshot and diffs it with the
+  last one; |on_change(tryjobs, changed)| is only called when some
+  builders changed, with the new snapshot and those builders' names.
+  """
+  POLL_INTERVAL = 10
+  IDLE_POLL_INTERVAL = 300
+
+  def __init__(self, crnumber, patchset, on_change):
+    self.crnumber = crnumber
+    self.patchset = patchset
+    self.on_change = on_change
+    self.tryjobs = {}
+    self.interval = self.POLL_INTERVAL
+    self.wakeup = threading.Event()
+
+  def Start(self):
+    threading.Thread(target=self._Run, daemon=True).start()
+
+  def Wake(self):
+    """Polls right away and resets the backoff."""
+    self.interval = self.POLL_INTERVAL
+    self.wakeup.set()
+
+  def _Run(self):
+    while True:
+      try:
+        cq = libgerrit.GetCQStatus(
+          self.crnumber, self.patchset, ttl=self.interval)
+      except Exception:
+        cq = None
+      self.Poll(cq)
+      self.wakeup.wait(self.interval)
+      self.wakeup.clear()
+
+  def Update(self, urls, statuses=None):
+    """Applies new tryjob |urls| and |statuses|, returning what changed."""
+    tryjobs = {bot: dict(data) for bot, data in self.tryjobs.items()}
+    for bot, url in urls.items():
+      if bot not in tryjobs:
+        tryjobs[bot] = {'name': bot, 'line': len(tryjobs)}
+      if tryjobs[bot].get('url') != url:
+        tryjobs[bot].update(url=url, status='UNKNOWN')
+    for bot, status in (statuses or {}).items():
+      tryjobs[bot]['status'] = status
+    changed = [bot for bot, data in tryjobs.items()
+               if data != self.tryjobs.get(bot)]
+    self.tryjobs = tryjobs
+    return changed
+
+  def _IsFinished(self, bot, url):
+    data = self.tryjobs.get(bot)
+    return bool(data and data['url'] == url and
+                data['status'] in libbuildbucket.FINISHED_BUILD_STATES)
+
+  def Poll(self, cq):
+    urls = {bot: data['url'] for bot, data in self.tryjobs.items()}
+    if cq:
+      urls.update(GetTryjobUrls(cq))
+    unfinished = {bot: {'url': url} for bot, url in urls.items()
+                  if not self._IsFinished(bot, url)}
+    statuses = QueryBotStatuses(unfinished, ttl=0) if unfinished else {}
+    changed = self.Update(urls, statuses)
+    idle = libbuildbucket.FINISHED_BUILD_STATES + ('ERROR',)
+    if changed or any(data['status'] not in idle
+                      for data in self.tryjobs.values()):
+      self.interval = self.POLL_INTERVAL
+    else:
+      self.interval = min(self.interval * 2, self.IDLE_POLL_INTERVAL)
+    if changed:
+      self.on_change(self.tryjobs, changed)
+
+
 class CRComments(UI.ScrollWindow):
   def __init__(self):
     super().__init__(up='k', down='j')
     self.comments_lines = []
+    self.layouts = {}
     self.fetcher_thread = None
     self.fetch_message = 'Pending'
 
+  def Layout(self, width):
+    """The comments wrapped to |width| columns, computed once per width."""
+    if width not in self.layouts:
+      self.layouts[width] = [
+        (piece, hpos, args)
+        for line, hpos, args in self.comments_lines
+        for piece in WrapLine(line, width - hpos)]
+    return self.layouts[width]
+
   def PaintComments(self, context):
-    lineno = 1
-    self.SetHeight(len(self.comments_lines))
-    for l, hpos, args in self.comments_lines:
-      if lineno < self.Height():
-        self.WriteString(hpos, lineno, l, *args)
-        lineno += 1
-      else:
-        return
+    # Only the rows on screen are written; the rest of the pad stays blank
+    # until it's scrolled into view.
+    lines = self.Layout(self.Width())
+    self.SetHeight(len(lines) + 1)
+    first = max(1, self.scroll_offset_y)
+    last = min(len(lines), self.scroll_offset_y + self.frame_h,
+               self.Height() - 1)
+    for lineno in range(first, last + 1):
+      l, hpos, args = lines[lineno - 1]
+      self.WriteString(hpos, lineno, l, *args)
 
   def FetchComments(self, context):
     comments = libgerrit.GetComments(context.crnumber)
     try:
-      author_revision_file = {}
-      for file in comments:
-        for comment in comments[file]:
-          author = comment.author.name
-          author_revision_file[author] = author_revision_file.get(author, {})
-          auth_dict = author_revision_file[author]
-          auth_dict[comment.patch_set] = auth_dict.get(comment.patch_set, {})
-          auth_dict[comment.patch_set][file] = auth_dict[comment.patch_set].get(
-            file, [])
-          auth_dict[comment.patch_set][file].append(
-            (comment.line, comment.message))
+      index = CommentIndex(comments)
       self.fetch_message = 'Parsed Files And Revision'
     except:
       self.fetch_message = 'File & Revision Parsing Failed'
       context.terminal.PaintWindow(self)
       return
 
-    def WriteLineAndExpand(line, hpos, *args):
-      if len(line) > self.Width() - hpos:
-        cut = self.Width() - hpos
-        while line[cut] != ' ':
-          cut -= 1
-        WriteLineAndExpand(line[0:cut], hpos, *args)
-        WriteLineAndExpand(line[cut+1:], hpos, *args)
-      else:
-        self.comments_lines.append((line, hpos, args))
-
     for m in context.cr.messages[::-1]:
       try:
-        writelines = len(m.message.split('\n'))
-        WriteLineAndExpand(
-          f'{m.author.name}:', 1, context.colors.GetColor(6, 8))
+        self.comments_lines.append(
+          (f'{m.author.name}:', 1, (context.colors.GetColor(6, 8),)))
         for l in m.message.split('\n'):
           if l.strip():
-            WriteLineAndExpand(l, 1)
+            self.comments_lines.append((l, 1, ()))
       except:
         self.fetch_message = 'Failed to expand comments'
         context.terminal.PaintWindow(self)
         return
 
       try:
-        files = author_revision_file.get(m.author.name, {}).get(
-          m._revision_number, {})
+        files = index.Files(m.author.name, m._revision_number)
         for file, cmts in files.items():
-          WriteLineAndExpand(file + ':', 2, context.colors.GetColor(7, 8))
-          for comment in cmts:
-            lnno, msg = comment
-            indent = f'Line {lnno}: '
-            WriteLineAndExpand(indent, 4, context.colors.GetColor(7, 8))
+          self.comments_lines.append(
+            (file + ':', 2, (context.colors.GetColor(7, 8),)))
+          for lnno, msg in cmts:
+            indent = f'Line {lnno}: ' if lnno else 'File: '
+            self.comments_lines.append(
+              (indent, 4, (context.colors.GetColor(7, 8),)))
             for cmtline in msg.split('\n'):
               if cmtline.strip():
-                WriteLineAndExpand(cmtline, 4+len(indent))
+                self.comments_lines.append((cmtline, 4+len(indent), ()))
       except:
         self.fetch_message = 'Failed to get comments for file'
         context.terminal.PaintWindow(self)
@@ -229,9 +299,84 @@ class CRComments(UI.ScrollWindow):
       self.WriteString(1, 1, f'Fetching Comments: {self.fetch_message}')
 
 
+class CommentIndex(object):
+  """A change's inline comments, indexed by (author, patchset, file, line).
+
+  Comments on the same line are kept together in the order gerrit sent
+  them, and each (author, patchset) remembers its keys so one review's
+  comments can be listed without scanning all of them.
+  """
+  def __init__(self, comments):
+    self.comments = {}
+    self.reviews = {}
+    for file in comments:
+      for comment in comments[file]:
+        key = (comment.author.name, comment.patch_set, file,
+               comment.line or None)
+        if key not in self.comments:
+          self.comments[key] = []
+          self.reviews.setdefault(key[:2], []).append(key)
+        self.comments[key].append(comment.message)
+
+  def Files(self, author, patchset):
+    """Returns {file: [(line, message), ...]} for one review."""
+    files = {}
+    for key in self.reviews.get((author, patchset), []):
+      for message in self.comments[key]:
+        files.setdefault(key[2], []).append((key[3], message))
+    return files
+
+
+def WrapLine(line, width):
+  """Yields pieces of |line| at most |width| long, split at spaces if possible.
+
+  Words longer than |width| are split wherever they hit the edge.
+  """
+  width = max(width, 1)
+  while len(line) > width:
+    cut = line.rfind(' ', 0, width + 1)
+    if cut <= 0:
+      yield line[:width]
+      line = line[width:]
+    else:
+      yield line[:cut]
+      line = line[cut+1:]
+  yield line
+
+
+def GetTryjobUrls(cq):
+  """Returns {builder: url} for the tryjobs of the latest CQ attempt."""
+  for result in cq.results[::-1]:
+    try:
+      return {p.builder: p.url for p in result.fields.jobs.JOB_PENDING}
+    except:
+      continue
+  return {}
+
+
+def QueryBotStatuses(tryjobs, ttl=libbuildbucket.BUILD_TTL):
+  """Fetches {builder: status} for every tryjob with one batched RPC."""
+  statuses = {}
+  requests = {}
+  for bot, data in tryjobs.items():
+    try:
+      requests[bot] = libgerrit.GetBuildRequest(data['url'], fields='status')
+    except Exception:
+      statuses[bot] = 'ERROR'
+  try:
+    builds = libbuildbucket.GetBuilds(list(requests.values()), ttl=ttl)
+  except Exception:
+    builds = [None] * len(requests)
+  for bot, build in zip(requests, builds):
+    statuses[bot] = 'ERROR' if isinstance(build, Exception) else (
+      build.status if build else 'ERROR')
+  return statuses
+
+
 def GetCLId():
-  if len(sys.argv) > 1 and sys.argv[1] != '--debug':
-    return sys.argv[1]
+  args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+  if args:
+    return args[0]
 
   r = librun.RunCommand('git cl issue')
   if r.returncode:
@@ -272,23 +417,14 @@ def debug_main():
   context = Context(GetCLId())
   revision = context.cr.revisions[context.cr.current_revision]
   cq = libgerrit.GetCQStatus(context.crnumber, revision._number)
-  def BotQuery(botname, boturl):
-    try:
-      status = libgerrit.GetBuildbotData(boturl, fields='status').status
-      print(f'{botname} :: {status}')
-    except Exception as e:
-      print(f'Ex {botname} :: {e}')
-
-  for result in cq.results[::-1]:
-    try:
-      for idx, p in enumerate(result.fields.jobs.JOB_PENDING):
-        threading.Thread(target=BotQuery, args=(p.builder, p.url)).start()
-      return
-    except:
-      continue
+  tryjobs = {bot: {'url': url} for bot, url in GetTryjobUrls(cq).items()}
+  for botname, status in QueryBotStatuses(tryjobs).items():
+    print(f'{botname} :: {status}')
 
 
 if __name__ == '__main__':
+  if '--no-cache' in sys.argv:
+    libhttp.Configure(cache=False)
   if '--debug' in sys.argv:
     debug_main()
   else:
@@ -0,0 +1,188 @@
+# libbuildbucket.py provides RO access to buildbucket's v2 pRPC API.
+
+
+import json
+import re
+
+from . import libhttp
+from . import libjson
+
+
+BUILDBUCKET_RPC_URL = 'https://cr-buildbucket.appspot.com/prpc/buildbucket.v2.Builds/{}'
+BUILDER_URL_REGEX = re.compile(
+  r'https://ci\.chromium\.org/(?:ui/)?p/([^/\s]+)/builders/([^/\s]+)/'
+  r'([^/\s]+)/(b?[0-9]+)')
+BUILD_ID_URL_REGEX = re.compile(
+  r'https://(?:ci\.chromium\.org/(?:ui/)?b|'
+  r'cr-buildbucket\.appspot\.com/build)/([0-9]+)')
+PRPC_PREFIX = ')]}\''
+
+DEFAULT_FIELDS = ('id', 'steps')
+BUILD_TTL = 30
+FINISHED_BUILD_STATES = ('SUCCESS', 'FAILURE', 'INFRA_FAILURE', 'CANCELED')
+
+
+def FieldMask(fields):
+  """Builds a pRPC field mask from a sequence of field paths."""
+  if isinstance(fields, str):
+    return fields
+  return ','.join(fields)
+
+
+def DecodePrpc(text):
+  """Strips the XSSI prefix pRPC puts in front of every JSON response."""
+  if text.startswith(PRPC_PREFIX):
+    text = text[len(PRPC_PREFIX):]
+  return json.loads(text)
+
+
+def _IsFinished(response):
+  decoded = DecodePrpc(response.text)
+  if 'responses' in decoded:
+    # A Batch response wraps each build, or an error in its place.
+    builds = [r.get('getBuild', {}) for r in decoded['responses']]
+  else:
+    builds = [decoded]
+  return bool(builds) and all(
+    b.get('status') in FINISHED_BUILD_STATES for b in builds)
+
+
+def Call(method, payload, ttl=BUILD_TTL):
+  """Calls Builds/|method| and returns the decoded response as a dict.
+
+  Responses are cached for |ttl| seconds, and permanently once every build
+  in them has finished (which requires 'status' in the field mask).
+  """
+  q = libhttp.Post(
+    BUILDBUCKET_RPC_URL.format(method),
+    data = json.dumps(payload),
+    headers = {
+      'content-type': 'application/json',
+      'accept': 'application/json',
+    },
+    ttl = ttl,
+    immutable = _IsFinished)
+  if q.status_code != 200:
+    raise ValueError(f'RPC {method} failed (code={q.status_code})')
+  return DecodePrpc(q.text)
+
+
+def BuildRequest(project, bucket, builder, build_number, fields=DEFAULT_FIELDS):
+  """The GetBuildRequest for a build.
+
+  |build_number| may be a build number, or a build id prefixed with 'b' as
+  it appears in ci.chromium.org urls.
+  """
+  build_number = str(build_number)
+  if build_number.startswith('b'):
+    return BuildRequestForId(build_number[1:], fields)
+  return {
+    'builder': {
+      'project': project,
+      'bucket': bucket,
+      'builder': builder,
+    },
+    'buildNumber': int(build_number),
+    'fields': FieldMask(fields),
+  }
+
+
+def BuildRequestForId(build_id, fields=DEFAULT_FIELDS):
+  return {'id': str(build_id), 'fields': FieldMask(fields)}
+
+
+def BuildRequestFromUrl(url, fields=DEFAULT_FIELDS):
+  """The GetBuildRequest for a ci.chromium.org or cr-buildbucket url."""
+  if match := BUILD_ID_URL_REGEX.match(url):
+    return BuildRequestForId(match.group(1), fields)
+  if match := BUILDER_URL_REGEX.match(url):
+    return BuildRequest(*match.groups(), fields=fields)
+  raise ValueError(f'{url} is not a buildbucket build url')
+
+
+def GetBuild(request):
+  """Get JSON for one build from a GetBuildRequest."""
+  return libjson.JSON.FromObj(Call('GetBuild', request))
+
+
+def GetBuilds(requests, ttl=BUILD_TTL):
+  """Get JSON for many builds with a single Batch RPC.
+
+  Returns one entry per GetBuildRequest, in order. A build that couldn't be
+  fetched is a ValueError in its place instead of JSON.
+  """
+  response = Call('Batch', {
+    'requests': [{'getBuild': request} for request in requests]
+  }, ttl=ttl)
+  builds = []
+  for entry in response.get('responses', []):
+    if 'getBuild' in entry:
+      builds.append(libjson.JSON.FromObj(entry['getBuild']))
+    else:
+      builds.append(ValueError(entry.get('error', {}).get('message')))
+  return builds
+
+
+def SearchBuilds(predicate, fields=DEFAULT_FIELDS, page_size=100):
+  """Get JSON for the builds matching a BuildPredicate."""
+  if isinstance(fields, str):
+    fields = fields.split(',')
+  response = Call('SearchBuilds', {
+    'predicate': predicate,
+    'fields': FieldMask(f'builds.*.{field}' for field in fields),
+    'pageSize': page_size,
+  })
+  return libjson.JSON.FromObj(response.get('builds', []))
+
+
+def StreamLog(view_url):
+  """Yields the lines of a step log without downloading all of it up front."""
+  separator = '&' if '?' in view_url else '?'
+  yield from libhttp.StreamLines(f'{view_url}{separator}format=raw')
+
+
+def StreamCommandArgs(view_url):
+  """Yields the arguments of an 'execution details' log's command.
+
+  These logs look like:
+    Executing command [
+      'python3',
+      '-u',
+      ...
+    ]
+  and reading stops at the closing bracket.
+  """
+  lines = StreamLog(view_url)
+  try:
+    if next(lines, '').strip() != 'Executing command [':
+      raise ValueError(f'Could not get command from {view_url}')
+    for line in lines:
+      line = line.strip()
+      if line == ']':
+        return
+      yield line.rstrip(',')[1:-1]
+  finally:
+    lines.close()
+
+
+def GetMbLookupFlags(view_url):
+  """Returns (builder group, builder) from a 'lookup GN args' step's log."""
+  flags = {}
+  previous = None
+  for arg in StreamCommandArgs(view_url):
+    if previous in ('-m', '-b'):
+      flags[previous] = arg
+      if len(flags) == 2:
+        return flags['-m'], flags['-b']
+    previous = arg
+  raise ValueError(f'Could not find -m and -b in {view_url}')
+
+
+def GetCompileTargets(view_url):
+  """Returns the targets passed to ninja after -j in a compile step's log."""
+  args = StreamCommandArgs(view_url)
+  for arg in args:
+    if arg == '-j':
+      next(args, None)
+      return list(args)
+  raise ValueError(f'Could not find ninja targets in {view_url}')
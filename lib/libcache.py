@@ -0,0 +1,25 @@
+# libcache.py locates the tools' shared on-disk cache and writes into it.
+
+import os
+import threading
+
+
+def Directory(*parts):
+  """~/.cache/chromium-src, or a subdirectory of it. Created if missing."""
+  directory = os.path.join(os.environ['HOME'], '.cache', 'chromium-src',
+                           *parts)
+  os.makedirs(directory, exist_ok=True)
+  return directory
+
+
+def WriteFile(path, contents):
+  """Writes |contents| (bytes) to |path| atomically.
+
+  Readers in other threads and processes see either the old file or the
+  whole new one, never a partial write.
+  """
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+  with open(temp, 'wb') as f:
+    f.write(contents)
+  os.replace(temp, path)
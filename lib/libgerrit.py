@@ -1,42 +1,167 @@
 # libgerrit.py provides tools for RO access to gerrit & the CQ.
 
 
-import json
+import collections
 import numbers
 import re
-import requests
+from concurrent import futures
 
+from . import libbuildbucket
+from . import libhttp
 from . import libjson
 
 
 CRREV_DETAIL_URL = 'https://chromium-review.googlesource.com/changes/{}/detail'
 CRREV_COMMENTS_URL = 'https://chromium-review.googlesource.com/changes/{}/comments'
 CRREV_DETAIL_URL_O = 'https://chromium-review.googlesource.com/changes/{}/detail?O=16314'
+CRREV_QUERY_URL = 'https://chromium-review.googlesource.com/changes/?q={}&n={}'
+QUERY_BATCH_SIZE = 50
 PATCHSET_STATUS_URL = ('https://chromium-cq-status.appspot.com/query/codereview'
                        '_hostname=chromium-review.googlesource.com/issue={}/'
                        'patchset={}')
 HOSTNAME_REGEX = re.compile(r'https://([a-zA-Z0-9\.\-]+)/.*')
-BUILDBOT_URL_REGEX = re.compile(r'p/(\S+)/builders/(\S+)/(\S+)/([0-9]+)')
-BUILDBOT_GENID_REGEX = re.compile(r'https://ci.chromium.org/b/([0-9]+)')
-BUILDBOT_RPC_URL = 'https://cr-buildbucket.appspot.com/prpc/buildbucket.v2.Builds/GetBuild'
+
+# How long (seconds) each kind of response may be served from the on-disk
+# cache before it is revalidated. Closed changes never change again, so
+# those are cached permanently regardless.
+DETAIL_TTL = 60
+COMMENTS_TTL = 60
+CQ_STATUS_TTL = 30
+CLOSED_CHANGE_STATES = ('MERGED', 'ABANDONED')
+
+# Gerrit's ListChangesOption bits, for the (hex) O= query parameter.
+LABELS = 1 << 0
+CURRENT_REVISION = 1 << 1
+CURRENT_COMMIT = 1 << 3
+DETAILED_ACCOUNTS = 1 << 7
+MESSAGES = 1 << 9
+SKIP_DIFFSTAT = 1 << 23
+
+# The options each field of a Change needs. Fields needing none are part of
+# every ChangeInfo.
+CHANGE_FIELD_OPTIONS = {
+  'status': 0,
+  'subject': 0,
+  'project': 0,
+  'branch': 0,
+  'change_id': 0,
+  'updated': 0,
+  'insertions': 0,
+  'deletions': 0,
+  'owner': DETAILED_ACCOUNTS,
+  'labels': LABELS,
+  'messages': MESSAGES,
+  'current_revision': CURRENT_REVISION,
+  'commit_message': CURRENT_REVISION | CURRENT_COMMIT,
+}
+Change = collections.namedtuple('Change', ['number', *CHANGE_FIELD_OPTIONS])
+
+
+def _IsClosedChange(detail):
+  return detail.status in CLOSED_CHANGE_STATES
+
+
+def _AreClosedChanges(crrev_ids, changes):
+  """Whether every one of |crrev_ids| came back in |changes|, closed.
+
+  Changes missing from a query (private, or not visible to us) may show up
+  later, so a partial result is never cached permanently.
+  """
+  closed = set(str(c._number) for c in changes if _IsClosedChange(c))
+  return bool(crrev_ids) and closed.issuperset(crrev_ids)
 
 
 def GetReviewDetail(crrev_id):
   """Get JSON representation of a cr."""
-  return libjson.JSON.FromURL(CRREV_DETAIL_URL_O.format(crrev_id))
-
-
-def GetCQStatus(crrev_id, patchset):
+  return libjson.JSON.FromURL(CRREV_DETAIL_URL_O.format(crrev_id),
+                              ttl=DETAIL_TTL, immutable=_IsClosedChange)
+
+
+def _QueryChanges(crrev_ids, options=0):
+  crrev_ids = sorted(set(str(c) for c in crrev_ids))
+  batches = [crrev_ids[i:i+QUERY_BATCH_SIZE]
+             for i in range(0, len(crrev_ids), QUERY_BATCH_SIZE)]
+  def _Query(batch):
+    query = '+OR+'.join(f'change:{c}' for c in batch)
+    url = CRREV_QUERY_URL.format(query, len(batch))
+    if options:
+      url += f'&O={options:x}'
+    return libjson.JSON.FromURL(
+      url, ttl=DETAIL_TTL,
+      immutable=lambda changes: _AreClosedChanges(batch, changes))
+  result = {}
+  with futures.ThreadPoolExecutor(max_workers=len(batches) or 1) as pool:
+    for changes in pool.map(_Query, batches):
+      for change in changes:
+        result[str(change._number)] = change
+  return result
+
+
+def GetReviewDetails(crrev_ids):
+  """Get {crrev_id: JSON} for many crs using bulk change queries.
+
+  The ids are split into batches of QUERY_BATCH_SIZE, and the batches are
+  queried concurrently. Changes that the query doesn't return (deleted,
+  private) are left out of the result.
+  """
+  return _QueryChanges(crrev_ids)
+
+
+def ChangeOptions(fields):
+  """The cheapest options bitmask that returns every one of |fields|."""
+  options = 0
+  for field in fields:
+    if field not in CHANGE_FIELD_OPTIONS:
+      raise ValueError(f'Unknown change field {field}')
+    options |= CHANGE_FIELD_OPTIONS[field]
+  if 'insertions' not in fields and 'deletions' not in fields:
+    options |= SKIP_DIFFSTAT
+  return options
+
+
+def _ChangeField(change, field):
+  if field == 'owner':
+    value = change.owner.name
+  elif field == 'commit_message':
+    revision = change.current_revision
+    value = revision and change.revisions[revision].commit.message
+  else:
+    value = getattr(change, field)
+  if isinstance(value, libjson.JSON) and value.json_obj is None:
+    return None
+  return value
+
+
+def QueryChanges(crrev_ids, fields=('status',)):
+  """Get {crrev_id: Change} for many crs, asking gerrit only for |fields|.
+
+  Like GetReviewDetails, but the query carries the smallest options mask
+  that covers |fields|, so checking the status of a whole branch stack is
+  one small request. Fields that weren't asked for are None.
+  """
+  fields = tuple(fields)
+  options = ChangeOptions(fields)
+  result = {}
+  for crrev_id, change in _QueryChanges(crrev_ids, options).items():
+    result[crrev_id] = Change(change._number, *(
+      _ChangeField(change, field) if field in fields else None
+      for field in CHANGE_FIELD_OPTIONS))
+  return result
+
+
+def GetCQStatus(crrev_id, patchset, ttl=CQ_STATUS_TTL):
   """Get JSON data for a cq job."""
-  return libjson.JSON.FromURL(PATCHSET_STATUS_URL.format(crrev_id, patchset))
+  return libjson.JSON.FromURL(PATCHSET_STATUS_URL.format(crrev_id, patchset),
+                              ttl=ttl)
 
 
 def GetComments(crrev_id):
-  return libjson.JSON.FromURL(CRREV_COMMENTS_URL.format(crrev_id))
+  return libjson.JSON.FromURL(CRREV_COMMENTS_URL.format(crrev_id),
+                              ttl=COMMENTS_TTL)
 
 
 def GetRedirectUrl(url):
-  q = requests.get(url = url, allow_redirects=False)
+  q = libhttp.Get(url, allow_redirects=False)
   if q.status_code == 301 or q.status_code == 302:
     return q.headers['Location']
   raise ValueError(f'{url} did not redirect (code={q.status_code})')
@@ -53,9 +178,10 @@ def GetHostname(url):
 #  - buildbot(unique_build_number_url)
 #  - buildbot(name_number_url)
 # We need to support them all.
-def GetBuildbotData(*args, **kwargs):
+def GetBuildbotData(*args, fields=libbuildbucket.DEFAULT_FIELDS):
   if len(args) == 4:
-    return _GetBuildbotData(*args, **kwargs)
+    return libbuildbucket.GetBuild(
+      libbuildbucket.BuildRequest(*args, fields=fields))
 
   if len(args) != 1:
     raise ValueError('Only supports full args or url')
@@ -64,44 +190,16 @@ def GetBuildbotData(*args, **kwargs):
   if not url.startswith('http'):
     raise ValueError('Only supports full args or url')
 
-  hostname = GetHostname(url)
-  if hostname == 'cr-buildbucket.appspot.com':
-    url = GetRedirectUrl(url)
-
-  hostname = GetHostname(url)
-  if hostname != 'ci.chromium.org':
-    raise ValueError('Redirect didnt lead to a ci.chromium.org url')
-
-  if BUILDBOT_GENID_REGEX.search(url):
-    url = GetRedirectUrl(url)
-
-  parsed = BUILDBOT_URL_REGEX.search(url)
-  if not parsed:
-    raise ValueError(f'URL {url} not matched by {BUILDBOT_URL_REGEX}')
-
-  groups = parsed.groups()
-  return _GetBuildbotData(groups[0], groups[1], groups[2], groups[3], **kwargs)
-
-def _GetBuildbotData(project, bucket, builder, buildNumber, fields='steps,id'):
-  rpc_payload = {
-    'builder': {
-      'project': project,
-      'bucket': bucket,
-      'builder': builder,
-    },
-    'buildNumber': buildNumber,
-    'fields': fields
-  }
-  q = requests.post(
-    url = BUILDBOT_RPC_URL,
-    data = json.dumps(rpc_payload),
-    headers = {
-      'content-type': 'application/json',
-      'accept': 'application/json',
-    })
-  if q.status_code != 200:
-    raise ValueError('Couldn\'t make RPC for buildbot data')
-  return libjson.JSON.FromObj(json.loads(q.text[5:]))
-
+  return libbuildbucket.GetBuild(GetBuildRequest(url, fields))
 
 
+def GetBuildRequest(url, fields=libbuildbucket.DEFAULT_FIELDS):
+  """Turns any build url into a GetBuildRequest, following redirects."""
+  try:
+    return libbuildbucket.BuildRequestFromUrl(url, fields)
+  except ValueError:
+    pass
+  redirect = GetRedirectUrl(url)
+  if GetHostname(redirect) != 'ci.chromium.org':
+    raise ValueError('Redirect didnt lead to a ci.chromium.org url')
+  return libbuildbucket.BuildRequestFromUrl(redirect, fields)
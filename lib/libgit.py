@@ -22,27 +22,110 @@ class Branch(object):
 
   @classmethod
   def GetAllBranches(cls):
+    snapshot = getattr(cls, '__snapshot', None)
+    if snapshot is not None:
+      yield from snapshot
+      return
     branches = librun.OutputOrError(
       'git branch --format "%(refname:short)"').split('\n')
     for branch in branches[::-1]:
       yield cls.Get(branch)
 
+  @classmethod
+  def LoadSnapshot(cls):
+    """Reads every local branch, upstream and config in two git calls.
+
+    The parent/child graph is built in memory, so after this Parent(),
+    Children() and config attribute lookups no longer spawn processes.
+    """
+    refs = librun.OutputOrError(
+      'git for-each-ref --format "%(refname:short)%00%(upstream:short)"'
+      ' refs/heads')
+    config = {}
+    result = librun.RunCommand('git config -z --get-regexp "^branch\\."')
+    for entry in result.stdout.split('\0'):
+      if not entry:
+        continue
+      key, _, value = entry.partition('\n')
+      name, _, attr = key[7:].rpartition('.')
+      config.setdefault(name, {})[attr] = value
+
+    branches = []
+    upstreams = {}
+    for line in refs.split('\n')[::-1]:
+      if not line:
+        continue
+      name, upstream = line.split('\0')
+      branch = cls.Get(name)
+      branch._config = config.get(name, {})
+      branch._children = []
+      upstreams[branch] = upstream
+      branches.append(branch)
+
+    try:
+      default = cls.Default()
+    except ValueError:
+      default = None
+    for branch in branches:
+      if upstreams[branch]:
+        branch._parent = cls.Get(upstreams[branch])
+      elif branch is not default and branch.Name() != 'heads/origin/main':
+        branch._parent = default
+      if branch._parent is not None and branch._parent._children is not None:
+        branch._parent._children.append(branch)
+
+    setattr(cls, '__snapshot', branches)
+    return branches
+
+  @classmethod
+  def GetAllAheadBehind(cls):
+    """Maps every local branch name to (ahead, behind) against its parent.
+
+    Branches with an upstream are counted by a single for-each-ref call;
+    only branches without one fall back to their own rev-list.
+    """
+    tracking = librun.OutputOrError(
+      'git for-each-ref --format "%(refname:short)%00%(upstream)'
+      '%00%(upstream:track,nobracket)" refs/heads')
+    result = {}
+    for line in tracking.split('\n'):
+      if not line:
+        continue
+      name, upstream, track = line.split('\0')
+      if not upstream or track == 'gone':
+        try:
+          result[name] = cls.Get(name).GetAheadBehind()
+        except (ValueError, AttributeError):
+          pass
+        continue
+      counts = {'ahead': 0, 'behind': 0}
+      for part in filter(None, track.split(', ')):
+        direction, count = part.split(' ')
+        counts[direction] = int(count)
+      result[name] = counts['ahead'], counts['behind']
+    return result
+
   @classmethod
   def Default(cls):
     default_name = librun.OutputOrError(
       'git symbolic-ref refs/remotes/origin/HEAD')
     return cls.Get(default_name[20:])
 
-  __slots__ = ('_branchname', '_children', '_parent')
+  __slots__ = ('_branchname', '_children', '_parent', '_config')
 
   def __init__(self, branchname:str):
     self._branchname = branchname
     self._children = None
     self._parent = None
+    self._config = None
 
   def __getattr__(self, attr:str):
-    return librun.OutputOrError(
-      f'git config --get branch.{self._branchname}.{attr}')
+    if self._config is not None:
+      if attr.lower() not in self._config:
+        raise ValueError(f'branch.{self._branchname}.{attr} is not set')
+      return self._config[attr.lower()]
+    return librun.GitOutputOrError(
+      'config', '--get', f'branch.{self._branchname}.{attr}')
 
   def __repr__(self):
     return str(self)
@@ -54,7 +137,10 @@ class Branch(object):
     return self._branchname
 
   def Children(self):
+    if self._children is None and getattr(Branch, '__snapshot', None) is None:
+      Branch.LoadSnapshot()
     if self._children is None:
+      # Branches outside refs/heads, like origin/main, aren't in the snapshot.
       self._children = []
       for branch in Branch.GetAllBranches():
         if branch.Parent() and branch.Parent().Name() == self.Name():
@@ -65,8 +151,8 @@ class Branch(object):
     if self._parent is not None:
       return self._parent
     try:
-      parent = librun.OutputOrError(
-        f'git rev-parse --abbrev-ref {self._branchname}@{{u}}')
+      parent = librun.GitOutputOrError(
+        'rev-parse', '--abbrev-ref', f'{self._branchname}@{{u}}')
       self._parent = Branch.Get(parent)
       return self._parent
     except ValueError:
@@ -0,0 +1,273 @@
+# libhttp.py provides one shared, pooled HTTP session for every network tool.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+from . import libcache
+
+
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = 60
+MAX_PER_HOST = 8
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CACHE_ENABLED = True
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# When set, every request is sent to this server instead, as
+# {BASE_URL}/{host}/{path}. replay_server.py serves recorded fixtures this way.
+# The on-disk cache is bypassed, so replayed responses never reach live runs.
+BASE_URL = os.environ.get('CHROMIUM_SRC_HTTP_BASE')
+# When set, every response from the network is saved here as a fixture.
+RECORD_DIRECTORY = os.environ.get('CHROMIUM_SRC_HTTP_RECORD')
+
+
+_lock = threading.Lock()
+_session = None
+_host_limits = {}
+_evicted = False
+
+
+def Configure(retries=None, backoff=None, timeout=None, max_per_host=None,
+              cache=None, base_url=None, record=None):
+  """Changes the session settings. Takes effect for the next new session."""
+  global RETRIES, BACKOFF, TIMEOUT, MAX_PER_HOST, CACHE_ENABLED, _session
+  global BASE_URL, RECORD_DIRECTORY
+  with _lock:
+    CACHE_ENABLED = CACHE_ENABLED if cache is None else cache
+    BASE_URL = BASE_URL if base_url is None else base_url
+    RECORD_DIRECTORY = RECORD_DIRECTORY if record is None else record
+    RETRIES = RETRIES if retries is None else retries
+    BACKOFF = BACKOFF if backoff is None else backoff
+    TIMEOUT = TIMEOUT if timeout is None else timeout
+    MAX_PER_HOST = MAX_PER_HOST if max_per_host is None else max_per_host
+    _session = None
+    _host_limits.clear()
+
+
+def Session():
+  """Returns the process-wide session, creating it on first use.
+
+  Connections are kept alive and pooled per host, and idempotent requests
+  (plus the read-only pRPC POSTs) are retried with exponential backoff.
+  """
+  global _session
+  with _lock:
+    if _session is None:
+      retry = Retry(total=RETRIES,
+                    backoff_factor=BACKOFF,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+                    raise_on_status=False)
+      adapter = HTTPAdapter(max_retries=retry,
+                            pool_connections=16,
+                            pool_maxsize=MAX_PER_HOST)
+      session = requests.Session()
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      _session = session
+    return _session
+
+
+def _HostLimit(url):
+  host = urlparse(url).netloc
+  with _lock:
+    if host not in _host_limits:
+      _host_limits[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+    return _host_limits[host]
+
+
+def Rewrite(url):
+  """Returns the url |url| is actually fetched from, honoring BASE_URL."""
+  if not BASE_URL:
+    return url
+  parsed = urlparse(url)
+  query = f'?{parsed.query}' if parsed.query else ''
+  return f'{BASE_URL.rstrip("/")}/{parsed.netloc}{parsed.path}{query}'
+
+
+def Request(method, url, **kwargs):
+  """Makes a request on the shared session, at most MAX_PER_HOST at a time."""
+  kwargs.setdefault('timeout', TIMEOUT)
+  target = Rewrite(url)
+  with _HostLimit(target):
+    response = Session().request(method, target, **kwargs)
+  if RECORD_DIRECTORY and response.status_code != 304:
+    RecordFixture(method, url, kwargs.get('data'), response)
+  return response
+
+
+def _Key(method, url, data):
+  key = hashlib.sha256(f'{method} {url}\n{data or ""}'.encode('utf-8'))
+  return key.hexdigest()
+
+
+def FixturePath(directory, method, url, data=None):
+  return os.path.join(directory, _Key(method, url, data))
+
+
+def RecordFixture(method, url, data, response):
+  """Saves |response| so replay_server.py can serve it for this request.
+
+  This reads the whole body, so streamed responses are only streamed from
+  memory while recording.
+  """
+  headers = {k: response.headers[k]
+             for k in ('Content-Type', 'ETag', 'Location')
+             if k in response.headers}
+  _WriteFile(FixturePath(RECORD_DIRECTORY, method, url, data), {
+    'method': method,
+    'url': url,
+    'status': response.status_code,
+    'headers': headers,
+  }, response.content)
+
+
+def ReadFixture(path):
+  """Returns (metadata, body) for a recorded fixture, or (None, None)."""
+  return _ReadCache(path)
+
+
+def StreamLines(url, chunk_size=16384, **kwargs):
+  """Yields the lines of |url|'s body as they arrive.
+
+  The body is read in |chunk_size| pieces, so a caller that stops iterating
+  early never downloads the rest of it. The connection is released when the
+  generator is closed.
+  """
+  response = Request('GET', url, stream=True, **kwargs)
+  try:
+    if response.status_code != 200:
+      raise ValueError(f'status code [{url}] = {response.status_code}')
+    for line in response.iter_lines(chunk_size=chunk_size):
+      yield line.decode('utf-8', errors='replace')
+  finally:
+    response.close()
+
+
+def _CacheDirectory():
+  return libcache.Directory('http')
+
+
+def _CachePath(method, url, data):
+  return os.path.join(_CacheDirectory(), _Key(method, url, data))
+
+
+def _ReadCache(path):
+  """Returns (metadata, body) for a cache entry, or (None, None)."""
+  try:
+    with open(path, 'rb') as f:
+      metadata = json.loads(f.readline())
+      return metadata, f.read()
+  except (OSError, ValueError):
+    return None, None
+
+
+def _WriteFile(path, metadata, body):
+  libcache.WriteFile(path, json.dumps(metadata).encode('utf-8') + b'\n' + body)
+
+
+def _WriteCache(path, metadata, body):
+  global _evicted
+  _WriteFile(path, metadata, body)
+  with _lock:
+    if _evicted:
+      return
+    _evicted = True
+  _EvictCache()
+
+
+def _EvictCache():
+  """Deletes the least recently used entries until under CACHE_MAX_BYTES."""
+  entries = []
+  with os.scandir(_CacheDirectory()) as it:
+    for entry in it:
+      # Other threads and processes write, replace and evict entries while
+      # this runs; skip their temp files and anything that's already gone.
+      if entry.name.endswith('.tmp'):
+        continue
+      try:
+        stat = entry.stat()
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, entry.path))
+  total = sum(size for _, size, _ in entries)
+  for _, size, path in sorted(entries):
+    if total <= CACHE_MAX_BYTES:
+      return
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    total -= size
+
+
+def _CachedResponse(url, metadata, body):
+  response = requests.Response()
+  response.status_code = 200
+  response.url = url
+  response.encoding = metadata.get('encoding') or 'utf-8'
+  response.headers.update(metadata.get('headers', {}))
+  response._content = body
+  return response
+
+
+def CachedRequest(method, url, ttl=0, immutable=None, **kwargs):
+  """Makes a request, answering it from the on-disk cache when possible.
+
+  A cached response younger than |ttl| seconds is returned without touching
+  the network. Older ones are revalidated with If-None-Match when the
+  server sent an ETag. If |immutable| returns True for a fresh response, it
+  is cached forever; use this for finished builds and closed changes.
+  """
+  if not CACHE_ENABLED or BASE_URL:
+    return Request(method, url, **kwargs)
+  path = _CachePath(method, url, kwargs.get('data'))
+  metadata, body = _ReadCache(path)
+  now = time.time()
+  if metadata:
+    if metadata['immutable'] or now - metadata['fetched'] < ttl:
+      try:
+        os.utime(path)
+      except OSError:
+        pass
+      return _CachedResponse(url, metadata, body)
+    if metadata.get('etag'):
+      headers = dict(kwargs.pop('headers', None) or {})
+      headers['If-None-Match'] = metadata['etag']
+      kwargs['headers'] = headers
+
+  response = Request(method, url, **kwargs)
+  if response.status_code == 304 and metadata:
+    metadata['fetched'] = now
+    _WriteCache(path, metadata, body)
+    return _CachedResponse(url, metadata, body)
+  if response.status_code == 200:
+    _WriteCache(path, {
+      'fetched': now,
+      'etag': response.headers.get('ETag'),
+      'encoding': response.encoding,
+      'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+      'immutable': bool(immutable and immutable(response)),
+    }, response.content)
+  return response
+
+
+def Get(url, ttl=None, immutable=None, **kwargs):
+  if ttl is None and immutable is None:
+    return Request('GET', url, **kwargs)
+  return CachedRequest('GET', url, ttl=ttl or 0, immutable=immutable, **kwargs)
+
+
+def Post(url, ttl=None, immutable=None, **kwargs):
+  if ttl is None and immutable is None:
+    return Request('POST', url, **kwargs)
+  return CachedRequest('POST', url, ttl=ttl or 0, immutable=immutable,
+                       **kwargs)
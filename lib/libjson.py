@@ -1,7 +1,8 @@
 
 import json
 import numbers
-import requests
+
+from . import libhttp
 
 
 class JSONError(Exception):
@@ -9,38 +10,75 @@ class JSONError(Exception):
     super().__init__(msg)
 
 class JSON(object):
+  """Read-only view over parsed JSON.
+
+  Child values are wrapped on first access and then memoized, so walking
+  the same path twice returns the same views instead of allocating new ones.
+  """
+  __slots__ = ('json_obj', 'type', '_children', '_items')
+
+  _TYPES = {str: 'str', list: 'list', dict: 'dict'}
+
   def __init__(self, json_obj):
     self.json_obj = json_obj
-    self.type = None
-    if type(self.json_obj) == str:
-      self.type = 'str'
-    elif type(self.json_obj) == list:
-      self.type = 'list'
-    elif type(self.json_obj) == dict:
-      self.type = 'dict'
-    elif isinstance(self.json_obj, numbers.Number):
+    self._children = None
+    self._items = None
+    self.type = JSON._TYPES.get(type(json_obj))
+    if self.type is None and isinstance(json_obj, numbers.Number):
       self.type = 'int'
 
+  def _Child(self, key, value):
+    if self._children is None:
+      self._children = {}
+    child = self._children[key] = JSON(value)
+    return child
+
   def __bool__(self):
     return bool(self.json_obj)
 
   def __getattr__(self, attr):
-    try:
-      if self.type == 'dict':
-        return JSON.FromObj(self.json_obj.get(attr))
-      if attr == 'RAW':
-        return self.json_obj
-    except:
-      raise JSONError(f'__getattr__({attr})')
+    if self.type == 'dict':
+      if self._children is not None and attr in self._children:
+        return self._children[attr]
+      value = self.json_obj.get(attr)
+      if type(value) not in (list, dict) and value is not None:
+        return value
+      return self._Child(attr, value)
+    if attr == 'RAW':
+      return self.json_obj
     raise JSONError(f'__getattr__({attr})')
 
   def __getitem__(self, index):
     if self.type == 'list':
-      return JSON.FromObj(self.json_obj[index])
+      if type(index) == slice:
+        return JSON.FromObj(self.json_obj[index])
+      return self._Items()[index]
     if self.type == 'dict':
-      return JSON.FromObj(self.json_obj[index])
+      if self._children is not None and index in self._children:
+        return self._children[index]
+      value = self.json_obj[index]
+      if type(value) not in (list, dict) and value is not None:
+        return value
+      return self._Child(index, value)
     raise JSONError(f'__getitem__({index})')
 
+  def _Items(self):
+    if self._items is None:
+      self._items = [
+        JSON(value) if type(value) in (list, dict) or value is None else value
+        for value in self.json_obj]
+    return self._items
+
+  def __len__(self):
+    if self.type in ('list', 'dict', 'str'):
+      return len(self.json_obj)
+    raise JSONError(f'__len__({self.type})')
+
+  def __contains__(self, item):
+    if self.type in ('list', 'dict', 'str'):
+      return item in self.json_obj
+    raise JSONError(f'__contains__({self.type})')
+
   def __repr__(self):
     return self.json_obj
 
@@ -49,13 +87,10 @@ class JSON(object):
 
   def __iter__(self):
     if self.type == 'list':
-      for index in self.json_obj:
-        yield JSON.FromObj(index)
+      return iter(self._Items())
     elif self.type == 'dict':
-      for index in self.json_obj.keys():
-        yield index
-    else:
-      raise JSONError(f'__iter__({self.type})')
+      return iter(self.json_obj.keys())
+    raise JSONError(f'__iter__({self.type})')
 
   @classmethod
   def FromObj(cls, obj):
@@ -69,12 +104,22 @@ class JSON(object):
       return obj
 
   @classmethod
-  def FromURL(cls, url):
-    q = requests.get(url=url)
+  def FromText(cls, text):
+    if text[0:4] == ')]}\'':
+      return JSON.FromObj(json.loads(text[5:]))
+    return JSON.FromObj(json.loads(text))
+
+  @classmethod
+  def FromURL(cls, url, ttl=None, immutable=None):
+    """Fetches |url| as JSON, caching it for |ttl| seconds if given.
+
+    |immutable| is called with the parsed JSON, and returning True caches
+    the response permanently.
+    """
+    if immutable is not None:
+      check = immutable
+      immutable = lambda response: check(JSON.FromText(response.text))
+    q = libhttp.Get(url, ttl=ttl, immutable=immutable)
     if q.status_code != 200:
       raise ValueError(f'status code [{url}] = {q.status_code}')
-      return None
-    elif q.text[0:4] == ')]}\'':
-      return JSON.FromObj(json.loads(q.text[5:]))
-    else:
-      return JSON.FromObj(json.loads(q.text))
+    return JSON.FromText(q.text)
@@ -0,0 +1,113 @@
+# libmb.py looks up the GN args chromium's bots build with, caching them.
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+
+from . import libcache
+
+
+MB_LOOKUP = './tools/mb/mb.py lookup -m {} -b {} --quiet'
+MB_CONFIG = 'tools/mb/mb_config.pyl'
+# Maps each builder group and builder to its gn-args.json, relative to the
+# directory this file is in.
+GN_ARGS_LOCATIONS = 'infra/config/generated/builders/gn_args_locations.json'
+FLAGS_FILE = 'lookup-flags.json'
+
+
+_lock = threading.Lock()
+
+
+def _CacheDirectory():
+  return libcache.Directory('gn-args')
+
+
+def _WriteJSON(path, value):
+  libcache.WriteFile(path, json.dumps(value).encode('utf-8'))
+
+
+def _ReadJSON(path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+
+def GNArgsFile(group, builder):
+  """The generated gn-args.json for a builder, or None if mb_config has it."""
+  locations = _ReadJSON(GN_ARGS_LOCATIONS) or {}
+  location = locations.get(group, {}).get(builder)
+  if location is None:
+    return None
+  return os.path.join(os.path.dirname(GN_ARGS_LOCATIONS), location)
+
+
+def ConfigHash(group, builder):
+  """Hashes the mb configs a builder's args come from in this checkout."""
+  digest = hashlib.sha256()
+  for path in (MB_CONFIG, GN_ARGS_LOCATIONS, GNArgsFile(group, builder)):
+    if path is None:
+      continue
+    digest.update(f'{path}\n'.encode('utf-8'))
+    try:
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+    except OSError:
+      pass
+  return digest.hexdigest()
+
+
+def ParseGNArgs(text):
+  args = {}
+  for line in text.split('\n'):
+    key, separator, value = line.partition(' = ')
+    if separator:
+      args[key.strip()] = value.strip()
+  return args
+
+
+def LookupGNArgs(group, builder):
+  """Returns {arg: value} for a builder, running mb.py only on a cache miss.
+
+  Results are keyed on (|group|, |builder|, ConfigHash()), so they stay
+  valid until the configs the builder's args come from change. An empty
+  result is never cached.
+  """
+  key = hashlib.sha256(
+    f'{group}\n{builder}\n{ConfigHash(group, builder)}'.encode('utf-8'))
+  path = os.path.join(_CacheDirectory(), key.hexdigest())
+  args = _ReadJSON(path)
+  if args:
+    return args
+  command = MB_LOOKUP.format(group, builder)
+  print(command)
+  try:
+    stdout = subprocess.check_output(command, shell=True)
+  except subprocess.CalledProcessError:
+    raise ValueError(f'Can\'t get gn args because this failed: {command}')
+  args = ParseGNArgs(str(stdout, 'utf-8'))
+  if args:
+    _WriteJSON(path, args)
+  return args
+
+
+def GetLookupFlags(bot, fetch):
+  """Returns (builder group, builder) for |bot|, like "project/bucket/name".
+
+  A bot's mb flags hardly ever change, so |fetch()| (which has to read a
+  build's step log) is only called the first time a bot is seen.
+  """
+  path = os.path.join(_CacheDirectory(), FLAGS_FILE)
+  with _lock:
+    flags = _ReadJSON(path) or {}
+    if bot in flags:
+      return tuple(flags[bot])
+  group, builder = fetch()
+  with _lock:
+    flags = _ReadJSON(path) or {}
+    flags[bot] = [group, builder]
+    _WriteJSON(path, flags)
+  return group, builder
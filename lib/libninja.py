@@ -0,0 +1,572 @@
+# libninja.py runs ninja and turns its output into a stream of build events.
+
+import array
+import bisect
+import collections
+import heapq
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from . import librun
+
+
+# ninja prints this in front of every edge it finishes when its output isn't
+# a terminal: [finished/total|running|overall edges/s|elapsed seconds]
+NINJA_STATUS = '[%f/%t|%r|%o|%e] '
+STATUS_LINE = re.compile(
+  r'^\[(\d+)/(\d+)\|(\d+)\|([0-9.]+|\?)\|([0-9.]+)\] (.*)$')
+NINJA_LOG = '.ninja_log'
+DRY_RUN_STATUS = re.compile(r'^\[(\d+)/(\d+)\] ')
+TELEMETRY_LOG = 'chrbuild_telemetry.jsonl'
+STALL_SECONDS = 300
+
+Progress = collections.namedtuple('Progress', [
+  'time', 'finished', 'total', 'running', 'rate', 'elapsed', 'description'])
+Edge = collections.namedtuple('Edge', ['time', 'output', 'start', 'end'])
+Output = collections.namedtuple('Output', ['time', 'line'])
+Stall = collections.namedtuple('Stall', ['time', 'idle', 'finished', 'total'])
+Finished = collections.namedtuple('Finished', [
+  'time', 'returncode', 'elapsed', 'finished', 'total'])
+
+
+def ParseLogLine(line):
+  """Returns (start ms, end ms, output) for a .ninja_log line, or None."""
+  if line.startswith('#'):
+    return None
+  fields = line.rstrip('\n').split('\t')
+  if len(fields) != 5:
+    return None
+  try:
+    return int(fields[0]), int(fields[1]), fields[3]
+  except ValueError:
+    return None
+
+
+class LogTail(object):
+  """Reads the lines ninja appends to .ninja_log while it builds.
+
+  Only lines written after construction are returned. If ninja recompacts
+  the log on startup, the new file is followed from the point it is noticed.
+  """
+  def __init__(self, path):
+    self._path = path
+    self._file = None
+    self._inode = None
+    self._Open(seek_end=True)
+
+  def _Open(self, seek_end):
+    try:
+      self._file = open(self._path)
+      self._inode = os.fstat(self._file.fileno()).st_ino
+      if seek_end:
+        self._file.seek(0, os.SEEK_END)
+    except OSError:
+      self._file = None
+
+  def Read(self):
+    """Yields (start, end, output) for every complete new line."""
+    try:
+      if os.stat(self._path).st_ino != self._inode:
+        if self._file:
+          self._file.close()
+        self._Open(seek_end=self._file is not None)
+    except OSError:
+      return
+    while self._file:
+      position = self._file.tell()
+      line = self._file.readline()
+      if not line.endswith('\n'):
+        self._file.seek(position)
+        return
+      entry = ParseLogLine(line)
+      if entry:
+        yield entry
+
+  def Close(self):
+    if self._file:
+      self._file.close()
+
+
+def Run(outdir, targets, jobs=None, listeners=(), stall_seconds=STALL_SECONDS):
+  """Builds |targets| in |outdir|, sending each event to every listener.
+
+  Returns a librun.CommandResult with all of ninja's stdout and stderr.
+  """
+  command = ['ninja', '-C', outdir, *targets]
+  if jobs:
+    command.append(f'-j{jobs}')
+  env = dict(os.environ, NINJA_STATUS=NINJA_STATUS)
+  log = LogTail(os.path.join(outdir, NINJA_LOG))
+  start = time.time()
+  process = subprocess.Popen(command, env=env, encoding='utf-8',
+                             errors='replace', stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+  lines = queue.Queue()
+  stderr = []
+  def _ReadStdout():
+    for line in process.stdout:
+      lines.put(line.rstrip('\n'))
+    lines.put(None)
+  def _ReadStderr():
+    stderr.extend(process.stderr)
+  readers = [threading.Thread(target=_ReadStdout),
+             threading.Thread(target=_ReadStderr)]
+  for reader in readers:
+    reader.start()
+
+  def _Send(event):
+    for listener in listeners:
+      listener(event)
+
+  stdout = []
+  last = None
+  last_change = time.time()
+  while True:
+    try:
+      line = lines.get(timeout=min(stall_seconds, 10))
+    except queue.Empty:
+      idle = time.time() - last_change
+      if idle >= stall_seconds:
+        _Send(Stall(time.time(), idle, *(last[1:3] if last else (0, 0))))
+        last_change = time.time()
+      continue
+    if line is None:
+      break
+    stdout.append(line)
+    now = time.time()
+    match = STATUS_LINE.match(line)
+    if not match:
+      _Send(Output(now, line))
+      continue
+    finished, total, running, rate, elapsed, description = match.groups()
+    last = Progress(now, int(finished), int(total), int(running),
+                    None if rate == '?' else float(rate), float(elapsed),
+                    description)
+    last_change = now
+    _Send(last)
+    for edge_start, edge_end, output in log.Read():
+      _Send(Edge(now, output, edge_start, edge_end))
+
+  for reader in readers:
+    reader.join()
+  returncode = process.wait()
+  for edge_start, edge_end, output in log.Read():
+    _Send(Edge(time.time(), output, edge_start, edge_end))
+  log.Close()
+  elapsed = time.time() - start
+  _Send(Finished(time.time(), returncode, elapsed,
+                 *(last[1:3] if last else (0, 0))))
+  return librun.CommandResult(command, '\n'.join(stdout), ''.join(stderr),
+                              returncode, elapsed)
+
+
+def GetTargets(outdir):
+  """Every target ninja knows about in |outdir|, from one graph load."""
+  result = librun.RunTimed(['ninja', '-C', outdir, '-t', 'targets', 'all'])
+  if result.returncode:
+    raise ValueError(f'Could not list targets in {outdir}:\n{result.stderr}')
+  return set(line.rpartition(': ')[0]
+             for line in result.stdout.split('\n')
+             if line and not line.startswith('ninja: '))
+
+
+def _Label(target):
+  """|target| as a GN label without the //, like base:base."""
+  label = target[2:] if target.startswith('//') else target
+  if ':' not in label:
+    label = f'{label}:{os.path.basename(label)}'
+  return label
+
+
+def _TargetNames(target):
+  yield target
+  label = _Label(target)
+  yield label
+  directory, _, name = label.partition(':')
+  if name == os.path.basename(directory):
+    yield directory
+  yield name
+
+
+def ResolveTargets(outdir, targets):
+  """Checks all of |targets| against |outdir|'s build graph at once.
+
+  GN labels are mapped to the names ninja knows them by, so //base and
+  //base:base both become base:base, or base if that's all ninja has.
+  Returns (targets to build, unknown targets), with one target per label.
+  """
+  known = GetTargets(outdir)
+  resolved = {}
+  unknown = []
+  for target in targets:
+    name = next((n for n in _TargetNames(target) if n in known), None)
+    if name is None:
+      unknown.append(target)
+    else:
+      resolved.setdefault(_Label(target), name)
+  return list(resolved.values()), unknown
+
+
+def CountEdges(outdir, targets):
+  """How many edges building |targets| would run, from a dry run."""
+  result = subprocess.run(['ninja', '-C', outdir, '-n', *targets],
+                          env=dict(os.environ, NINJA_STATUS='[%f/%t] '),
+                          encoding='utf-8', errors='replace',
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  if result.returncode:
+    raise ValueError(f'Dry run in {outdir} failed:\n{result.stderr}')
+  for line in result.stdout.split('\n'):
+    if match := DRY_RUN_STATUS.match(line):
+      return int(match.group(2))
+  return 0
+
+
+def SplitJobs(budget, work):
+  """Splits |budget| ninja jobs between builds in proportion to their |work|.
+
+  Returns the -j for each build, in order. Builds with nothing to do get 0
+  and every other build gets at least 1.
+  """
+  total = sum(work)
+  return [max(1, budget * edges // total) if edges else 0 for edges in work]
+
+
+def _Duration(seconds):
+  seconds = int(seconds)
+  if seconds >= 3600:
+    return f'{seconds // 3600}h{seconds % 3600 // 60:02}m'
+  return f'{seconds // 60}m{seconds % 60:02}s'
+
+
+class ProgressDisplay(object):
+  """Renders build events as a progress line.
+
+  The rate is averaged over the last |window| seconds, so it tracks the
+  current phase of the build rather than the whole run. On a terminal the
+  line is redrawn in place; otherwise it is printed every |interval|
+  seconds.
+  """
+  def __init__(self, stream=None, window=60, interval=30):
+    self._stream = stream or sys.stdout
+    self._tty = self._stream.isatty()
+    self._window = window
+    self._interval = interval
+    self._samples = collections.deque()
+    self._printed = 0
+    self._status = ''
+
+  def _Rate(self, event):
+    self._samples.append((event.time, event.finished))
+    while self._samples[0][0] < event.time - self._window:
+      self._samples.popleft()
+    first_time, first_finished = self._samples[0]
+    if event.time - first_time < 1:
+      return event.rate or 0
+    return (event.finished - first_finished) / (event.time - first_time)
+
+  def _Write(self, line):
+    if self._tty:
+      width = shutil.get_terminal_size().columns - 1
+      self._stream.write(f'\r{line[:width]:<{width}}')
+      self._stream.flush()
+    else:
+      print(line, file=self._stream, flush=True)
+
+  def _Clear(self):
+    if self._tty and self._status:
+      self._stream.write('\r\033[K')
+
+  def __call__(self, event):
+    if isinstance(event, Progress):
+      rate = self._Rate(event)
+      remaining = event.total - event.finished
+      eta = _Duration(remaining / rate) if rate else '?'
+      self._status = (f'[{event.finished}/{event.total}] {rate:.1f} edges/s, '
+                      f'{event.running} running, ETA {eta} '
+                      f'{event.description}')
+      if self._tty or event.time - self._printed >= self._interval:
+        self._printed = event.time
+        self._Write(self._status)
+    elif isinstance(event, Output):
+      self._Clear()
+      print(event.line, file=self._stream)
+      if self._tty and self._status:
+        self._Write(self._status)
+    elif isinstance(event, Stall):
+      self._Clear()
+      print(f'No edges finished for {_Duration(event.idle)} '
+            f'({event.finished}/{event.total})', file=self._stream)
+    elif isinstance(event, Finished):
+      self._Clear()
+      rate = event.finished / event.elapsed if event.elapsed else 0
+      print(f'Finished {event.finished}/{event.total} edges in '
+            f'{_Duration(event.elapsed)} ({rate:.1f} edges/s), '
+            f'returncode={event.returncode}', file=self._stream, flush=True)
+
+
+class MultiProgressDisplay(ProgressDisplay):
+  """Shows several concurrent builds on one progress line.
+
+  Each build sends its events to its own Listener(name), and any output it
+  prints is prefixed with that name.
+  """
+  def __init__(self, stream=None, interval=30):
+    super().__init__(stream, interval=interval)
+    self._lock = threading.Lock()
+    self._builds = {}
+
+  def Listener(self, name):
+    return lambda event: self._Update(name, event)
+
+  def _Update(self, name, event):
+    with self._lock:
+      if isinstance(event, Progress):
+        self._builds[name] = f'{name} {event.finished}/{event.total}'
+        self._status = ', '.join(self._builds.values())
+        if self._tty or event.time - self._printed >= self._interval:
+          self._printed = event.time
+          self._Write(self._status)
+      elif isinstance(event, Output):
+        self._Clear()
+        print(f'[{name}] {event.line}', file=self._stream)
+        if self._tty and self._status:
+          self._Write(self._status)
+      elif isinstance(event, Stall):
+        self._Clear()
+        print(f'[{name}] No edges finished for {_Duration(event.idle)}',
+              file=self._stream)
+      elif isinstance(event, Finished):
+        self._Clear()
+        self._builds[name] = f'{name} done'
+        self._status = ', '.join(self._builds.values())
+        print(f'[{name}] Finished {event.finished}/{event.total} edges in '
+              f'{_Duration(event.elapsed)}, returncode={event.returncode}',
+              file=self._stream, flush=True)
+
+
+class TelemetryLog(object):
+  """Appends every build event to a JSONL file."""
+  def __init__(self, path):
+    self._file = open(path, 'a')
+
+  def __call__(self, event):
+    record = {'event': type(event).__name__, **event._asdict()}
+    self._file.write(json.dumps(record) + '\n')
+    if isinstance(event, (Stall, Finished)):
+      self._file.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused):
+    self._file.close()
+
+
+class NinjaLog(object):
+  """The edges of the last build recorded in a .ninja_log.
+
+  The log is read a line at a time into parallel arrays, so a log with
+  millions of entries costs a few machine words per edge instead of an
+  object each. ninja appends entries in the order edges finish, with times
+  relative to when it started, so an end time going backwards means a new
+  build began and everything before it is dropped. An edge with several
+  outputs is logged once per output; those are folded into one edge.
+  """
+  def __init__(self):
+    self.starts = array.array('q')
+    self.ends = array.array('q')
+    self.outputs = []
+
+  @classmethod
+  def Read(cls, path):
+    log = cls()
+    previous = None
+    with open(path) as f:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5 or line.startswith('#'):
+          continue
+        try:
+          start, end = int(fields[0]), int(fields[1])
+        except ValueError:
+          continue
+        if log.ends and end < log.ends[-1]:
+          log = cls()
+        elif previous == (start, end, fields[4]):
+          continue
+        previous = (start, end, fields[4])
+        log.starts.append(start)
+        log.ends.append(end)
+        log.outputs.append(fields[3])
+    return log
+
+  def __len__(self):
+    return len(self.outputs)
+
+  def Duration(self, edge):
+    return self.ends[edge] - self.starts[edge]
+
+  def WallTime(self):
+    if not self.outputs:
+      return 0
+    return max(self.ends) - min(self.starts)
+
+  def Slowest(self, count):
+    """The |count| longest edges, longest first."""
+    return heapq.nlargest(count, range(len(self)), key=self.Duration)
+
+  def WeightedDurations(self):
+    """Each edge's duration, divided among the edges running alongside it.
+
+    These add up to the build's wall time, so they show what held the build
+    up rather than what used the most CPU.
+    """
+    starts = sorted(self.starts)
+    ends = sorted(self.ends)
+    weight_at = {}
+    running = 0
+    weight = 0.0
+    last = 0
+    i = j = 0
+    while j < len(ends):
+      now = min(starts[i], ends[j]) if i < len(starts) else ends[j]
+      if running:
+        weight += (now - last) / running
+      last = now
+      weight_at[now] = weight
+      while j < len(ends) and ends[j] == now:
+        running -= 1
+        j += 1
+      while i < len(starts) and starts[i] == now:
+        running += 1
+        i += 1
+    return array.array('d', (weight_at[end] - weight_at[start]
+                             for start, end in zip(self.starts, self.ends)))
+
+  def CriticalPath(self):
+    """An estimate of the chain of edges that determined the wall time.
+
+    The log has no dependency information, so this starts at the edge that
+    finished last and repeatedly steps to the edge that finished last
+    before the current one started, which is the latest a dependency could
+    have finished. Returned in build order.
+    """
+    if not self.outputs:
+      return []
+    order = sorted(range(len(self)), key=self.ends.__getitem__)
+    ends = [self.ends[edge] for edge in order]
+    position = len(order) - 1
+    path = [order[position]]
+    while True:
+      # Only edges ahead of this one in |order| are candidates, so an edge
+      # that took no time doesn't find itself and end the walk.
+      position = bisect.bisect_right(
+        ends, self.starts[path[-1]], hi=position) - 1
+      if position < 0:
+        return path[::-1]
+      path.append(order[position])
+
+  def CostByDirectory(self):
+    """Returns {directory: (edges, total ms, weighted ms)}."""
+    weighted = self.WeightedDurations()
+    costs = {}
+    for edge, output in enumerate(self.outputs):
+      directory = Directory(output)
+      count, total, weight = costs.get(directory, (0, 0, 0.0))
+      costs[directory] = (count + 1, total + self.Duration(edge),
+                          weight + weighted[edge])
+    return costs
+
+  def TraceEvents(self):
+    """The edges as Chrome trace events, one thread row per ninja job."""
+    events = []
+    free = []
+    busy = []
+    for edge in sorted(range(len(self)), key=self.starts.__getitem__):
+      while busy and busy[0][0] <= self.starts[edge]:
+        heapq.heappush(free, heapq.heappop(busy)[1])
+      tid = heapq.heappop(free) if free else len(busy)
+      heapq.heappush(busy, (self.ends[edge], tid))
+      events.append({
+        'name': self.outputs[edge],
+        'cat': Directory(self.outputs[edge]),
+        'ph': 'X',
+        'ts': self.starts[edge] * 1000,
+        'dur': self.Duration(edge) * 1000,
+        'pid': 0,
+        'tid': tid,
+      })
+    return events
+
+
+def Directory(output):
+  """The GN directory/target an output was built for.
+
+  obj/content/browser/browser/foo.o is content/browser/browser, and the
+  toolchain prefix of outputs like clang_x64/obj/... is dropped.
+  """
+  parts = output.split('/')
+  for marker in ('obj', 'gen'):
+    if marker in parts[:-1]:
+      parts = parts[parts.index(marker) + 1:]
+      break
+  return '/'.join(parts[:-1]) or '.'
+
+
+def _Ms(ms):
+  if ms < 60000:
+    return f'{ms / 1000:.1f}s'
+  return _Duration(ms / 1000)
+
+
+def Report(log, top=20):
+  """Yields the lines of a text report on where |log|'s build spent time."""
+  yield (f'{len(log)} edges, {_Ms(log.WallTime())} wall time, '
+         f'{_Ms(sum(log.ends) - sum(log.starts))} total')
+  path = log.CriticalPath()
+  yield ''
+  yield (f'Critical path: {len(path)} edges, '
+         f'{_Ms(sum(log.Duration(edge) for edge in path))} '
+         f'(estimated from timing). Longest {top} on it:')
+  longest = set(heapq.nlargest(top, path, key=log.Duration))
+  for edge in path:
+    if edge in longest:
+      yield f'  {_Ms(log.Duration(edge)):>8}  {log.outputs[edge]}'
+  yield ''
+  yield f'Slowest {top} edges:'
+  for edge in log.Slowest(top):
+    yield f'  {_Ms(log.Duration(edge)):>8}  {log.outputs[edge]}'
+  yield ''
+  yield f'Most expensive {top} directories (weighted, total, edges):'
+  costs = log.CostByDirectory()
+  for directory in heapq.nlargest(top, costs, key=lambda d: costs[d][2]):
+    count, total, weighted = costs[directory]
+    yield f'  {_Ms(weighted):>8} {_Ms(total):>8} {count:>7}  {directory}'
+
+
+def CompareReport(old, new, top=20):
+  """Yields the lines of a report on how |new|'s build differs from |old|'s."""
+  yield (f'Wall time: {_Ms(old.WallTime())} -> {_Ms(new.WallTime())}, '
+         f'edges: {len(old)} -> {len(new)}')
+  old_costs = old.CostByDirectory()
+  new_costs = new.CostByDirectory()
+  changes = {}
+  for directory in old_costs.keys() | new_costs.keys():
+    before = old_costs.get(directory, (0, 0, 0.0))
+    after = new_costs.get(directory, (0, 0, 0.0))
+    changes[directory] = (after[2] - before[2], before, after)
+  yield ''
+  yield f'Biggest {top} changes by directory (weighted time, edges):'
+  for directory in heapq.nlargest(top, changes,
+                                  key=lambda d: abs(changes[d][0])):
+    delta, before, after = changes[directory]
+    sign = '+' if delta >= 0 else '-'
+    yield (f'  {sign}{_Ms(abs(delta)):>8}  {_Ms(before[2])} -> '
+           f'{_Ms(after[2])}, {before[0]} -> {after[0]}  {directory}')
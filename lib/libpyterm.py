@@ -44,6 +44,22 @@ class Window(object, metaclass=abc.ABCMeta):
       self.WriteString(0, 0, str(e))
     self.Redecorate()
 
+  def RepaintRow(self, context, row):
+    """Repaints a single row, returning False to ask for a full repaint."""
+    return False
+
+  def PaintRows(self, context, rows):
+    try:
+      # Rows past the bottom can't be drawn, and moving there would raise.
+      for row in sorted(r for r in rows if r < self.Height()):
+        self._window.move(row, 0)
+        self._window.clrtoeol()
+        if not self.RepaintRow(context, row):
+          return self.Paint(context)
+    except Exception as e:
+      self.WriteString(0, 0, str(e))
+    self.Redecorate()
+
   def WriteString(self, x, y, string, *args):
     try:
       self._window.addstr(y, x, string, *args)
@@ -85,6 +101,9 @@ class ScrollWindow(Window, metaclass=abc.ABCMeta):
   __slots__ = ('frame_x', 'frame_y', 'frame_w', 'frame_h',
                'scroll_offset_y', 'realheight', 'upkey', 'downkey')
 
+  # curses pads can't be taller than this.
+  MAX_HEIGHT = 32767
+
   def __init__(self, up=None, down=None):
     super().__init__(curses.newpad(1, 1))
     self.scroll_offset_y = 0
@@ -123,7 +142,7 @@ class ScrollWindow(Window, metaclass=abc.ABCMeta):
     self.SetHeight(delta + self.realheight)
 
   def SetHeight(self, newheight):
-    self.realheight = min(newheight, 127)
+    self.realheight = min(newheight, self.MAX_HEIGHT)
     self.realheight = max(self.realheight, self.frame_h)
     self._window.resize(self.realheight, self.frame_w)
 
@@ -138,7 +157,8 @@ class ScrollWindow(Window, metaclass=abc.ABCMeta):
       self.scroll_offset_y = max(self.scroll_offset_y-1, 0)
       return True
     if keycode == self.downkey:
-      self.scroll_offset_y = min(self.scroll_offset_y+1, self.frame_h-1)
+      self.scroll_offset_y = min(self.scroll_offset_y+1,
+                                 max(self.realheight-self.frame_h-1, 0))
       return True
     return False
 
@@ -211,9 +231,10 @@ class StartupEvent(Event):
 
 
 class RepaintRequestedEvent(Event):
-  def __init__(self, windows):
+  def __init__(self, windows, rows=None):
     super().__init__(RepaintRequestedEvent)
     self.windows = windows
+    self.rows = rows
 
 
 class Colorizer(object):
@@ -318,32 +339,51 @@ class Terminal(object):
       elif event.GetType() == RepaintRequestedEvent:
         self.repaintqueue.put(event)
 
-  def _RepaintInternal(self, event):
+  def _RepaintInternal(self, targets):
     self.screen.refresh()
-    if event.windows:
-      for win in event.windows:
-        win.Paint(self.context)
-    else:
-      for _, win in self.windows:
+    if targets is None:
+      targets = {win: None for _, win in self.windows}
+    for win, rows in targets.items():
+      if rows is None:
         win.Paint(self.context)
+      else:
+        win.PaintRows(self.context, rows)
+
+  def _CoalesceRepaints(self, events):
+    """Merges queued repaints into {window: rows}, or None for everything.
+
+    A window's rows are None when the whole window needs repainting.
+    """
+    targets = {}
+    for event in events:
+      if event.windows is None:
+        return None
+      for win in event.windows:
+        if event.rows is None or targets.get(win, set()) is None:
+          targets[win] = None
+        else:
+          targets[win] = targets.get(win, set()) | set(event.rows)
+    return targets
 
   def _RepaintThreadInternal(self):
     while True:
-      event = self.repaintqueue.get()
+      events = [self.repaintqueue.get()]
       with self.repaintqueue.mutex:
+        events.extend(self.repaintqueue.queue)
         self.repaintqueue.queue.clear()
-      if event.GetType() == EndedEvent:
+      if any(e.GetType() == EndedEvent for e in events):
         return
-      if event.GetType() == RepaintRequestedEvent:
-        self._RepaintInternal(event)
+      self._RepaintInternal(self._CoalesceRepaints(
+        e for e in events if e.GetType() == RepaintRequestedEvent))
 
   def PaintWindows(self):
     if not self.finished:
       self.eventqueue.put(RepaintRequestedEvent(None))
 
-  def PaintWindow(self, window):
+  def PaintWindow(self, window, rows=None):
+    """Repaints |window|, or only its |rows| if given."""
     if not self.finished:
-      self.eventqueue.put(RepaintRequestedEvent([window]))
+      self.eventqueue.put(RepaintRequestedEvent([window], rows))
 
   def PassKey(self, keycode):
     if not self.finished:
@@ -1,6 +1,10 @@
 
 import os
 import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
 
 
 def RunCommand(command):
@@ -17,6 +21,155 @@ def OutputOrError(cmd):
   return result.stdout.strip()
 
 
+CommandResult = namedtuple('CommandResult',
+  ['command', 'stdout', 'stderr', 'returncode', 'walltime'])
+
+
+def RunTimed(command, timeout=None):
+  """Runs |command| and returns a CommandResult.
+
+  |command| is run through the shell if it is a string, and directly if it
+  is a list. A command that exceeds |timeout| seconds is killed and gets a
+  returncode of None.
+  """
+  start = time.time()
+  try:
+    result = subprocess.run(command,
+                            encoding='utf-8',
+                            errors='replace',
+                            shell=isinstance(command, str),
+                            stderr=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            timeout=timeout)
+    return CommandResult(command, result.stdout, result.stderr,
+                         result.returncode, time.time() - start)
+  except subprocess.TimeoutExpired as e:
+    def _decode(output):
+      if isinstance(output, bytes):
+        return output.decode('utf-8', errors='replace')
+      return output or ''
+    return CommandResult(command, _decode(e.stdout), _decode(e.stderr),
+                         None, time.time() - start)
+
+
+def RunAsync(command, timeout=None, executor=None):
+  """Starts |command| on a worker thread and returns a Future[CommandResult]."""
+  if executor is None:
+    if not hasattr(RunAsync, '__executor'):
+      setattr(RunAsync, '__executor',
+              futures.ThreadPoolExecutor(max_workers=os.cpu_count()))
+    executor = getattr(RunAsync, '__executor')
+  return executor.submit(RunTimed, command, timeout)
+
+
+def RunMany(commands, jobs=None, timeout=None):
+  """Runs |commands| with at most |jobs| in flight at once.
+
+  Yields a CommandResult for each command, in the order they were given.
+  """
+  with futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+    pending = [pool.submit(RunTimed, command, timeout) for command in commands]
+    for future in pending:
+      yield future.result()
+
+
+def RunGit(*args):
+  """Runs git directly, skipping the /bin/sh that RunCommand starts."""
+  return subprocess.run(['git', *args],
+                        encoding='utf-8',
+                        errors='replace',
+                        stderr=subprocess.PIPE,
+                        stdout=subprocess.PIPE)
+
+
+def GitOutputOrError(*args):
+  result = RunGit(*args)
+  if result.returncode:
+    raise ValueError(f'|git {" ".join(args)}|:\n {result.stderr}')
+  return result.stdout.strip()
+
+
+class GitCatFile(object):
+  """A long-lived `git cat-file` process for resolving refs and objects.
+
+  `--batch-check` and `--batch` are started lazily on first use and then
+  reused for every query, so lookups cost a pipe round trip rather than a
+  fork/exec. Use GitCatFile.Get() to share one instance per repository.
+  """
+  __slots__ = ('_cwd', '_check', '_batch', '_lock')
+
+  @classmethod
+  def Get(cls, cwd=None):
+    cwd = os.path.realpath(cwd or os.getcwd())
+    if not hasattr(cls, '__pool'):
+      setattr(cls, '__pool', {})
+    pool = getattr(cls, '__pool')
+    if cwd not in pool:
+      pool[cwd] = cls(cwd)
+    return pool[cwd]
+
+  def __init__(self, cwd):
+    self._cwd = cwd
+    self._check = None
+    self._batch = None
+    self._lock = threading.Lock()
+
+  def _Start(self, mode):
+    return subprocess.Popen(['git', 'cat-file', mode],
+                            cwd=self._cwd,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+
+  def _Query(self, process, ref):
+    if '\n' in ref:
+      raise ValueError(f'invalid object name: {ref!r}')
+    process.stdin.write(f'{ref}\n'.encode('utf-8'))
+    process.stdin.flush()
+    header = process.stdout.readline()
+    if not header:
+      raise ValueError(f'git cat-file exited while reading {ref}')
+    header = header.decode('utf-8').split()
+    if len(header) != 3:
+      return None
+    return header[0], header[1], int(header[2])
+
+  def Info(self, ref):
+    """Returns (sha, type, size) for |ref|, or None if it doesn't exist."""
+    with self._lock:
+      if self._check is None:
+        self._check = self._Start('--batch-check')
+      return self._Query(self._check, ref)
+
+  def Resolve(self, ref):
+    info = self.Info(ref)
+    if info is None:
+      raise ValueError(f'{ref} does not name an object')
+    return info[0]
+
+  def Read(self, ref):
+    """Returns (sha, type, contents) for |ref|, or None if it doesn't exist."""
+    with self._lock:
+      if self._batch is None:
+        self._batch = self._Start('--batch')
+      info = self._Query(self._batch, ref)
+      if info is None:
+        return None
+      sha, objtype, size = info
+      contents = self._batch.stdout.read(size)
+      self._batch.stdout.read(1)  # trailing newline
+      return sha, objtype, contents
+
+  def Close(self):
+    with self._lock:
+      for process in (self._check, self._batch):
+        if process is not None:
+          process.stdin.close()
+          process.wait()
+      self._check = None
+      self._batch = None
+
+
 class cd(object):
   def __init__(self, path):
     self._path = path
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import importlib.util
+import subprocess
+import sys
+import time
+
+from lib import libjson
+
+
+def load_baseline(revision):
+  source = subprocess.check_output(
+    ['git', 'show', f'{revision}:lib/libjson.py'], encoding='utf-8')
+  source = source.replace('from . import libhttp', '')
+  spec = importlib.util.spec_from_loader('libjson_baseline', loader=None)
+  module = importlib.util.module_from_spec(spec)
+  exec(source, module.__dict__)
+  return module
+
+
+def make_build(steps):
+  return {
+    'id': '1234',
+    'status': 'FAILURE',
+    'steps': [{
+      'name': f'step {i}',
+      'status': 'SUCCESS',
+      'logs': [{'name': 'stdout', 'viewUrl': f'https://logs/{i}'}] * 3,
+    } for i in range(steps)],
+  }
+
+
+def walk(build):
+  found = 0
+  for step in build.steps:
+    for log in step.logs:
+      if log.name == 'stdout' and step.status == 'SUCCESS':
+        found += 1
+  return found
+
+
+def chain(cr, repeat):
+  for _ in range(repeat):
+    cr.revisions[cr.current_revision].commit.message
+
+
+def bench(name, JSON, build, cr, repeat):
+  start = time.time()
+  for _ in range(repeat):
+    walk(JSON.FromObj(build))
+  walked = time.time() - start
+  wrapped = JSON.FromObj(build)
+  start = time.time()
+  for _ in range(repeat):
+    walk(wrapped)
+  rewalked = time.time() - start
+  start = time.time()
+  chain(JSON.FromObj(cr), repeat * 1000)
+  chained = time.time() - start
+  print(f'{name:>10}: walk {walked:.3f}s  re-walk {rewalked:.3f}s  '
+        f'attribute chain {chained:.3f}s')
+
+
+def main(revision, steps=5000, repeat=20):
+  """Compares libjson.JSON with the class at |revision|.
+
+  Pass the last revision before the change being measured; there's no safe
+  default, since HEAD~1 stops being that as soon as more commits land.
+  """
+  build = make_build(int(steps))
+  cr = {
+    'current_revision': 'abc',
+    'revisions': {'abc': {'commit': {'message': 'Fix it'}}},
+  }
+  print(f'{steps} steps, {repeat} repetitions')
+  bench('baseline', load_baseline(revision).JSON, build, cr, int(repeat))
+  bench('libjson', libjson.JSON, build, cr, int(repeat))
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    sys.exit(f'usage: {sys.argv[0]} <baseline revision> [steps] [repeat]')
+  main(*sys.argv[1:])
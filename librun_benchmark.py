@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+
+from lib import librun
+
+
+def bench(name, resolve, refs):
+  start = time.time()
+  for ref in refs:
+    resolve(ref)
+  elapsed = time.time() - start
+  print(f'{name:>30}: {elapsed:.3f}s ({len(refs) / elapsed:.0f} refs/s)')
+
+
+def main(count=1000):
+  branches = librun.GitOutputOrError(
+    'for-each-ref', '--format=%(refname:short)', 'refs/heads').split('\n')
+  refs = [branches[i % len(branches)] for i in range(int(count))]
+  print(f'Resolving {len(refs)} refs across {len(branches)} branches')
+  bench('git rev-parse (shell)',
+        lambda r: librun.OutputOrError(f'git rev-parse {r}'), refs)
+  bench('git rev-parse (no shell)',
+        lambda r: librun.GitOutputOrError('rev-parse', r), refs)
+  catfile = librun.GitCatFile.Get()
+  bench('git cat-file --batch-check', catfile.Resolve, refs)
+  catfile.Close()
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:])
@@ -7,9 +7,12 @@ YELLOW = colors.Color(colors.YELLOW)
 GREEN = colors.Color(colors.GREEN)
 RESET = colors.Color()
 
-def prune_branch(branch, delete_me=True):
+def prune_branch(branch, ahead_behind, delete_me=True):
   name = branch.Name()
-  branch_ahead, branch_behind = branch.GetAheadBehind()
+  if name in ahead_behind:
+    branch_ahead, branch_behind = ahead_behind[name]
+  else:
+    branch_ahead, branch_behind = branch.GetAheadBehind()
   children = branch.Children()
   if branch_ahead == 0 and branch_behind == 0 and delete_me:
     print(f'{YELLOW}Deleting: {name}{RESET}')
@@ -27,12 +30,13 @@ def prune_branch(branch, delete_me=True):
           print(f'    {GREEN} Removed {name} from {c.Name()}\'s tree{RESET}')
 
   for c in children:
-    prune_branch(libgit.Branch.Get(c.Name()))
+    prune_branch(libgit.Branch.Get(c.Name()), ahead_behind)
 
 
 def prune():
   librun.RunCommand(f'git checkout main')
-  prune_branch(libgit.Branch.Get('main'), False)
+  ahead_behind = libgit.Branch.GetAllAheadBehind()
+  prune_branch(libgit.Branch.Get('main'), ahead_behind, False)
 
 if __name__ == '__main__':
   prune()
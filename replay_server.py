@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Serves recorded HTTP fixtures as a stand-in for gerrit, CQ and buildbucket.
+
+Record fixtures by running any tool with CHROMIUM_SRC_HTTP_RECORD set. Only
+responses that come from the network are recorded, so skip the HTTP cache:
+  CHROMIUM_SRC_HTTP_RECORD=~/fixtures ./gerrit-ncurses.py --debug --no-cache 1234567
+
+Then serve them, and point the tools at the server instead of the network:
+  ./replay_server.py ~/fixtures --port 8765 --latency 0.1
+  CHROMIUM_SRC_HTTP_BASE=http://localhost:8765 ./gerrit-ncurses.py --debug ...
+"""
+
+import http.server
+import sys
+import time
+
+from lib import libargs, libhttp
+
+
+COMMAND = libargs.ArgumentParser()
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+  """Answers {host}/{path} requests from fixtures recorded for that url.
+
+  |latency| seconds pass before every response starts, and its body is
+  written at |throughput| bytes per second (unlimited when 0).
+  """
+  protocol_version = 'HTTP/1.1'
+  fixtures = None
+  latency = 0
+  throughput = 0
+  verbose = False
+
+  def do_GET(self):
+    self._Replay('GET')
+
+  def do_POST(self):
+    self._Replay('POST')
+
+  def _Replay(self, method):
+    length = int(self.headers.get('Content-Length') or 0)
+    data = self.rfile.read(length).decode('utf-8') if length else None
+    url = f'https://{self.path.lstrip("/")}'
+    metadata, body = libhttp.ReadFixture(
+      libhttp.FixturePath(self.fixtures, method, url, data))
+    time.sleep(self.latency)
+
+    if metadata is None:
+      sys.stderr.write(f'No fixture for {method} {url}\n')
+      return self._Respond(404, {}, b'')
+    etag = metadata['headers'].get('ETag')
+    if etag and self.headers.get('If-None-Match') == etag:
+      return self._Respond(304, {'ETag': etag}, b'')
+    self._Respond(metadata['status'], metadata['headers'], body)
+
+  def _Respond(self, status, headers, body):
+    self.send_response(status)
+    for header, value in headers.items():
+      self.send_header(header, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    if not self.throughput:
+      self.wfile.write(body)
+      return
+    chunk = max(1, self.throughput // 10)
+    for start in range(0, len(body), chunk):
+      self.wfile.write(body[start:start+chunk])
+      self.wfile.flush()
+      time.sleep(len(body[start:start+chunk]) / self.throughput)
+
+  def log_message(self, *args):
+    if self.verbose:
+      super().log_message(*args)
+
+
+@COMMAND
+def serve(fixtures:str, port:int=8765, latency:float=0.0,
+          throughput:int=0, verbose:bool=False):
+  """Serve recorded fixtures on localhost.
+
+  |latency| is in seconds, |throughput| in bytes per second (0 = no limit).
+  """
+  FixtureHandler.fixtures = fixtures
+  FixtureHandler.latency = latency
+  FixtureHandler.throughput = throughput
+  FixtureHandler.verbose = verbose
+  server = http.server.ThreadingHTTPServer(('localhost', port), FixtureHandler)
+  print(f'Serving {fixtures} on http://localhost:{port}')
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  COMMAND.eval()
@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 
-import json
 import os
 import re
-import requests
-import subprocess
 import sys
+from concurrent import futures
 from dataclasses import dataclass
 from urllib.parse import urlparse
 
+from lib import libbuildbucket
+from lib import libmb
+from lib import libninja
 
-RPC = 'https://cr-buildbucket.appspot.com/prpc/buildbucket.v2.Builds/GetBuild'
+
+# ninja jobs shared by every bot being built at once.
+JOB_BUDGET = 5000
+# Roughly how much memory one link of a bot build needs, which bounds how
+# many links can run locally at a time.
+LINK_MEMORY_GB = 8
 
 
 def find_by_name(entries, name):
@@ -22,15 +28,20 @@ def find_by_name(entries, name):
 
 
 def once(fn):
-  fn.__data = None
-  def replacement(*args, **kwargs):
-    if fn.__data is not None:
-      return fn.__data
-    fn.__data = fn(*args, **kwargs)
-    return fn.__data
+  attr = f'_once_{fn.__name__}'
+  def replacement(self, *args, **kwargs):
+    if getattr(self, attr, None) is None:
+      setattr(self, attr, fn(self, *args, **kwargs))
+    return getattr(self, attr)
   return replacement
 
 
+def concurrent_links(builds):
+  """How many links each of |builds| concurrent bot builds may run."""
+  memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  return max(1, int(memory / 2**30 / LINK_MEMORY_GB / builds))
+
+
 @dataclass
 class CIBuild:
   url: str
@@ -51,58 +62,38 @@ class CIBuild:
       raise ValueError(f'URL must be in the format: {url_pattern}')
     return CIBuild(url, *match.groups())
 
-  def _get_self_json(self) -> str:
-    return json.dumps({
-      'builder': {
-        'project': self.project,
-        'bucket': self.bucket,
-        'builder': self.builder,
-      },
-      'buildNumber': self.buildid,
-      'fields': 'steps,id',
-    })
+  def _get_build_request(self) -> dict:
+    return libbuildbucket.BuildRequest(
+      self.project, self.bucket, self.builder, self.buildid)
 
   @once
-  def _make_rpc(self) -> 'JSON':
-    q = requests.post(
-      url=RPC,
-      data=self._get_self_json(),
-      headers={
-        'content-type': 'application/json',
-        'accept': 'application/json'
-      })
-    if q.status_code != 200:
-      raise ValueError(f'RPC to {RPC} failed')
-    return json.loads(q.text[5:])
+  def _make_rpc(self) -> dict:
+    return libbuildbucket.Call('GetBuild', self._get_build_request())
+
+  def outdir(self) -> str:
+    return f'out/BOT_{self.builder}'
 
   def outdir_exists(self) -> bool:
-    return os.path.exists(f'out/BOT_{self.builder}')
+    return os.path.exists(self.outdir())
 
-  def snag_gn_args(self) -> {str, str}:
+  def _get_lookup_flags(self) -> (str, str):
     lookup_args = find_by_name(self._make_rpc().get('steps'), 'lookup GN args')
     url = find_by_name(lookup_args.get('logs'), 'execution details')['viewUrl']
-    raw = str(requests.get(f'{url}?format=raw').content, 'utf-8').split('\n')
-    m_flag, b_flag = None, None
-    for i, line in enumerate(raw):
-      line = line.strip()[1:-2]
-      if line == '-m':
-        m_flag = raw[i+1].strip()[1:-2]
-      elif line == '-b':
-        b_flag = raw[i+1].strip()[1:-2]
-      if None not in (m_flag, b_flag):
-        print(f'./tools/mb/mb.py lookup -m {m_flag} -b {b_flag} --quiet')
-        raw_flags = str(subprocess.check_output(
-          f'./tools/mb/mb.py lookup -m {m_flag} -b {b_flag} --quiet',
-          shell=True), 'utf-8').split('\n')
-        split_flags = [f.split(' = ') for f in raw_flags]
-        return {e[0]:e[1] for e in split_flags if len(e) > 1}
-    raise ValueError('Couldnt get the args for mb.py')
-
-  def create_outdir(self):
+    return libbuildbucket.GetMbLookupFlags(url)
+
+  def snag_gn_args(self) -> {str, str}:
+    m_flag, b_flag = libmb.GetLookupFlags(
+      f'{self.project}/{self.bucket}/{self.builder}', self._get_lookup_flags)
+    return libmb.LookupGNArgs(m_flag, b_flag)
+
+  def create_outdir(self, links=None):
     if self.outdir_exists():
       return
     gn_args = self.snag_gn_args()
 
+    if links:
+      gn_args['concurrent_links'] = str(links)
+
     if 'coverage_instrumentation_input_file' in gn_args:
       gn_args.pop('coverage_instrumentation_input_file')
 
@@ -111,33 +102,21 @@ class CIBuild:
       gn_args['goma_dir'] = f'"{root}/third_party/depot_tools/.cipd_bin"'
 
     args = '\n'.join(f'{k}={v}' for k,v in gn_args.items())
-    cmd = f'gn gen out/BOT_{self.builder} -check --args=\'{args}\''
+    cmd = f'gn gen {self.outdir()} -check --args=\'{args}\''
     os.system(cmd)
 
   def _get_targets_gbf(self):
     steps = self._make_rpc().get('steps')
     gen = find_by_name(steps, 'generate_build_files (with patch)')
     swarming = find_by_name(gen.get('logs'), 'swarming-targets-file.txt')
-    url = f'{swarming["viewUrl"]}?format=raw'
-    targets = str(requests.get(url).content, 'utf-8').split('\n')
+    targets = libbuildbucket.StreamLog(swarming['viewUrl'])
     return set(t.strip() for t in targets if t.strip())
 
   def _get_targets_comp(self):
     steps = self._make_rpc().get('steps')
     gen = find_by_name(steps, 'compile')
     exec_details = find_by_name(gen.get('logs'), 'execution details')
-    url = f'{exec_details["viewUrl"]}?format=raw'
-    cmd = str(requests.get(url).content, 'utf-8').split('\n')
-    cmd = [c.strip() for c in cmd]
-    targets = None
-    for c in cmd:
-      if c == "'80',":
-        targets = []
-        continue
-      if c == ']':
-        return targets
-      if targets is not None:
-        targets.append(c[1:-2])
+    return libbuildbucket.GetCompileTargets(exec_details['viewUrl'])
 
   def get_targets(self):
     try:
@@ -150,32 +129,81 @@ class CIBuild:
       pass
     return ['all']
 
-  def build_targets(self, targets):
-    failcount = 0
-    while targets:
-      if failcount == 10:
-        targets = ['all']
-      print(f'ninja -C out/BOT_{self.builder} -j5000 {{{len(targets)} targets}}')
-      output = subprocess.run(
-        ['ninja', '-C', f'out/BOT_{self.builder}', '-j5000', *targets],
-        stderr=subprocess.PIPE, stdout=None)
-      if output.returncode != 0:
-        error = str(output.stderr)
-        if 'unknown target' in error:
-          bad_target = error.split('unknown target')[1].split('\'')[1]
-          targets.remove(bad_target)
-          print(f'cant build target: {bad_target}')
-          failcount += 1
-          continue
-        raise ValueError(error)
-      return
+  def resolve_targets(self, targets) -> [str]:
+    targets, unknown = libninja.ResolveTargets(self.outdir(), targets)
+    for bad_target in unknown:
+      print(f'cant build target: {bad_target}')
+    if not targets:
+      raise ValueError(f'None of the bot\'s targets exist in {self.outdir()}')
+    return targets
+
+  def prepare(self, links=None) -> [str]:
+    """Generates the out dir and returns the bot's targets that exist in it."""
+    self.create_outdir(links)
+    return self.resolve_targets(self.get_targets())
+
+  def build_targets(self, targets, jobs=JOB_BUDGET, listeners=None):
+    outdir = self.outdir()
+    print(f'ninja -C {outdir} -j{jobs} {{{len(targets)} targets}}')
+    listeners = listeners or [libninja.ProgressDisplay()]
+    telemetry = os.path.join(outdir, libninja.TELEMETRY_LOG)
+    with libninja.TelemetryLog(telemetry) as log:
+      output = libninja.Run(outdir, targets, jobs, listeners=[*listeners, log])
+    if output.returncode != 0:
+      raise ValueError(output.stderr)
 
   def pull_and_build(self):
-    self.create_outdir()
-    self.build_targets(self.get_targets())
+    self.build_targets(self.prepare())
+
+
+def build_bots(builds, budget=JOB_BUDGET):
+  """Reproduces several bots' builds at once.
+
+  The out dirs are generated concurrently, each one allowed its share of
+  the machine's links. Then every ninja runs at the same time, with
+  |budget| jobs split between them by how many edges each has left.
+  """
+  links = concurrent_links(len(builds))
+  def _Prepare(build):
+    targets = build.prepare(links)
+    return targets, libninja.CountEdges(build.outdir(), targets)
+
+  ready = []
+  work = []
+  with futures.ThreadPoolExecutor(max_workers=len(builds)) as pool:
+    prepared = [pool.submit(_Prepare, build) for build in builds]
+    for build, future in zip(builds, prepared):
+      try:
+        targets, edges = future.result()
+      except Exception as e:
+        print(f'Skipping {build.builder}: {e}')
+        continue
+      ready.append((build, targets))
+      work.append(edges)
+  if not ready:
+    raise ValueError('None of the bots could be prepared')
+
+  jobs = libninja.SplitJobs(budget, work)
+  display = libninja.MultiProgressDisplay()
+  failed = []
+  with futures.ThreadPoolExecutor(max_workers=len(ready)) as pool:
+    running = [
+      (build, pool.submit(build.build_targets, targets, j,
+                          [display.Listener(build.builder)]))
+      for (build, targets), j in zip(ready, jobs) if j]
+    for build, future in running:
+      try:
+        future.result()
+      except ValueError as e:
+        print(f'{build.builder} failed:\n{e}')
+        failed.append(build.builder)
+  if failed:
+    raise ValueError(f'Builds failed: {", ".join(failed)}')
 
 
 if __name__ == '__main__':
-  build = CIBuild.from_bot_url(sys.argv[1])
-  args = build.pull_and_build()
-
+  builds = [CIBuild.from_bot_url(url) for url in sys.argv[1:]]
+  if len(builds) == 1:
+    builds[0].pull_and_build()
+  else:
+    build_bots(builds)
@@ -1,29 +1,405 @@
 #!/usr/bin/env python3
 
+import json
 import sys
 import re
 import os
-from lib import librun
+import shutil
+import sqlite3
+import struct
+import subprocess
+import threading
+import time
+import queue
+from concurrent import futures
+
+from lib import libcache
+
+
+FRAME = re.compile(
+  r'#\d+ 0x[a-f0-9]+  \(([\/A-Za-z\.0-9\-_]+)\.so\+0x([a-f0-9]+).+')
+ADDRESS = re.compile(r'^0x[0-9a-f]+$')
+SENTINEL = '0xffffffffffffffff'
+
+
+class SymbolizerProcess(object):
+  """A long-lived symbolizer process for a single module.
+
+  Addresses are streamed through the process's stdin and their
+  [(function, location), ...] frames (innermost first, including inlined
+  frames) are read back off its stdout.
+  """
+  def __init__(self, module, command):
+    self._module = module
+    self._process = subprocess.Popen(command,
+                                     encoding='utf-8',
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+    self._lock = threading.Lock()
+
+  def _Write(self, offsets):
+    try:
+      for offset in offsets:
+        self._process.stdin.write(f'0x{offset}\n')
+      self._process.stdin.write(f'{SENTINEL}\n')
+      self._process.stdin.flush()
+    except (OSError, ValueError):
+      # The process died or was closed; _Read notices when its stdout ends.
+      pass
+
+  def Lookup(self, offsets):
+    """Returns {offset: [(function, location), ...]} for hex |offsets|."""
+    with self._lock:
+      # Write from another thread so large batches can't deadlock on a full
+      # stdout pipe while we're still writing addresses.
+      writer = threading.Thread(target=self._Write, args=(offsets,))
+      writer.start()
+      try:
+        return self._Read(offsets)
+      finally:
+        writer.join()
+
+  def _Read(self, offsets):
+    raise NotImplementedError()
+
+  def IsAlive(self):
+    return self._process.poll() is None
+
+  def Close(self):
+    with self._lock:
+      try:
+        self._process.stdin.close()
+      except OSError:
+        pass
+      self._process.wait()
+
+
+class Addr2Line(SymbolizerProcess):
+  def __init__(self, module):
+    super().__init__(module, ['addr2line', '-f', '-C', '-i', '-a',
+                              '-e', module])
+
+  def _Read(self, offsets):
+    # With -a each result starts with the address that was queried, which is
+    # the only way to tell where one address's inlined frames end.
+    result = {}
+    frames = None
+    remaining = list(offsets)
+    while True:
+      line = self._process.stdout.readline()
+      if not line:
+        raise ValueError(f'addr2line exited while symbolizing {self._module}')
+      line = line.rstrip('\n')
+      if ADDRESS.match(line):
+        if line == SENTINEL:
+          self._process.stdout.readline()
+          self._process.stdout.readline()
+          return result
+        frames = []
+        result[remaining.pop(0)] = frames
+      else:
+        frames.append((line, self._process.stdout.readline().rstrip('\n')))
+
+
+class LlvmSymbolizer(SymbolizerProcess):
+  def __init__(self, module):
+    super().__init__(module, ['llvm-symbolizer', f'--obj={module}', '-C'])
+
+  def _Read(self, offsets):
+    # Each address's frames are terminated by a blank line.
+    result = {}
+    for offset in [*offsets, None]:
+      frames = []
+      while True:
+        function = self._process.stdout.readline()
+        if not function:
+          raise ValueError(
+            f'llvm-symbolizer exited while symbolizing {self._module}')
+        if function == '\n':
+          break
+        # Drop the column so locations read the same as addr2line's.
+        location = self._process.stdout.readline().rstrip('\n')
+        frames.append((function.rstrip('\n'), location.rsplit(':', 1)[0]))
+      if offset is not None:
+        result[offset] = frames
+    return result
+
+
+def GetBuildId(module):
+  """Reads the NT_GNU_BUILD_ID note out of an ELF file, or returns None."""
+  try:
+    with open(module, 'rb') as f:
+      data = f.read(64)
+      if data[:4] != b'\x7fELF':
+        return None
+      is64 = data[4] == 2
+      endian = '<' if data[5] == 1 else '>'
+      if is64:
+        shoff, = struct.unpack_from(f'{endian}Q', data, 0x28)
+        shentsize, shnum = struct.unpack_from(f'{endian}HH', data, 0x3a)
+      else:
+        shoff, = struct.unpack_from(f'{endian}I', data, 0x20)
+        shentsize, shnum = struct.unpack_from(f'{endian}HH', data, 0x2e)
+      f.seek(shoff)
+      sections = f.read(shentsize * shnum)
+      for i in range(shnum):
+        header = sections[i*shentsize:(i+1)*shentsize]
+        if is64:
+          _, kind, _, _, offset, size = struct.unpack_from(
+            f'{endian}IIQQQQ', header)
+        else:
+          _, kind, _, _, offset, size = struct.unpack_from(
+            f'{endian}IIIIII', header)
+        if kind != 7:  # SHT_NOTE
+          continue
+        f.seek(offset)
+        notes = f.read(size)
+        cursor = 0
+        while cursor + 12 <= len(notes):
+          namesz, descsz, notetype = struct.unpack_from(
+            f'{endian}III', notes, cursor)
+          cursor += 12
+          name = notes[cursor:cursor+namesz]
+          cursor += (namesz + 3) & ~3
+          desc = notes[cursor:cursor+descsz]
+          cursor += (descsz + 3) & ~3
+          if notetype == 3 and name == b'GNU\0':  # NT_GNU_BUILD_ID
+            return desc.hex()
+  except (OSError, struct.error):
+    pass
+  return None
+
+
+class SymbolCache(object):
+  """On-disk cache of symbolized frames keyed on (build-id, offset).
+
+  Entries are evicted least-recently-used first once there are more than
+  |max_entries|. A rebuilt module gets a new build-id, so its stale
+  entries are never read again and age out.
+  """
+  def __init__(self, path, max_entries=500000):
+    self._db = sqlite3.connect(path, check_same_thread=False)
+    self._db.execute('CREATE TABLE IF NOT EXISTS symbols ('
+                     'build_id TEXT, offset TEXT, frames TEXT, used INTEGER, '
+                     'PRIMARY KEY (build_id, offset)) WITHOUT ROWID')
+    self._db.execute(
+      'CREATE INDEX IF NOT EXISTS symbols_used ON symbols (used)')
+    self._max_entries = max_entries
+    self._lock = threading.Lock()
+
+  def Get(self, build_id, offsets):
+    """Returns {offset: frames} for the |offsets| that are cached."""
+    result = {}
+    now = int(time.time())
+    with self._lock, self._db:
+      for offset in offsets:
+        row = self._db.execute(
+          'SELECT frames FROM symbols WHERE build_id=? AND offset=?',
+          (build_id, offset)).fetchone()
+        if row:
+          result[offset] = [tuple(f) for f in json.loads(row[0])]
+      self._db.executemany(
+        'UPDATE symbols SET used=? WHERE build_id=? AND offset=?',
+        [(now, build_id, offset) for offset in result])
+    return result
+
+  def Put(self, build_id, symbols):
+    now = int(time.time())
+    with self._lock, self._db:
+      self._db.executemany(
+        'INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?)',
+        [(build_id, offset, json.dumps(frames), now)
+         for offset, frames in symbols.items()])
+
+  def Evict(self):
+    with self._lock, self._db:
+      count, = self._db.execute('SELECT COUNT(*) FROM symbols').fetchone()
+      if count > self._max_entries:
+        self._db.execute(
+          'DELETE FROM symbols WHERE (build_id, offset) IN ('
+          'SELECT build_id, offset FROM symbols ORDER BY used LIMIT ?)',
+          (count - self._max_entries,))
+
+  def Close(self):
+    self.Evict()
+    self._db.close()
+
+
+def GetSymbolCache():
+  try:
+    return SymbolCache(os.path.join(libcache.Directory(), 'symbols.db'))
+  except (OSError, sqlite3.Error):
+    return None
+
+
+class Symbolizer(object):
+  """Symbolizes (module, offset) pairs with one process per module."""
+  def __init__(self, cache=None):
+    self._processes = {}
+    self._build_ids = {}
+    self._cache = {}
+    self._disk_cache = cache
+    self._lock = threading.Lock()
+    self._tool = LlvmSymbolizer
+    if shutil.which('llvm-symbolizer') is None:
+      self._tool = Addr2Line
+
+  def _Process(self, module):
+    with self._lock:
+      process = self._processes.get(module)
+      if process is None or not process.IsAlive():
+        if process:
+          process.Close()
+        process = self._processes[module] = self._tool(module)
+      return process
+
+  def _Discard(self, module, process):
+    with self._lock:
+      if self._processes.get(module) is process:
+        del self._processes[module]
+    process.Close()
+
+  def _BuildId(self, module):
+    with self._lock:
+      if module not in self._build_ids:
+        self._build_ids[module] = GetBuildId(module)
+      return self._build_ids[module]
+
+  def _Resolve(self, module, offsets):
+    build_id = self._BuildId(module) if self._disk_cache else None
+    result = {}
+    if build_id:
+      result = self._disk_cache.Get(build_id, offsets)
+    missing = [o for o in offsets if o not in result]
+    if missing:
+      process = self._Process(module)
+      try:
+        resolved = process.Lookup(missing)
+      except (OSError, ValueError):
+        self._Discard(module, process)
+        raise
+      if build_id:
+        self._disk_cache.Put(build_id, resolved)
+      result.update(resolved)
+    for offset, frames in result.items():
+      self._cache[(module, offset)] = frames
+
+  def Lookup(self, frames):
+    """Returns {(module, offset): [(function, location), ...]}."""
+    modules = {}
+    for module, offset in frames:
+      if (module, offset) not in self._cache:
+        modules.setdefault(module, set()).add(offset)
+    with futures.ThreadPoolExecutor(max_workers=len(modules) or 1) as pool:
+      lookups = {module: pool.submit(self._Resolve, module, list(offsets))
+                 for module, offsets in modules.items()}
+      for module, lookup in lookups.items():
+        try:
+          lookup.result()
+        except (OSError, ValueError):
+          # One module that can't be symbolized shouldn't lose the others.
+          for offset in modules[module]:
+            self._cache.setdefault((module, offset), [])
+    return {frame: self._cache[frame] for frame in frames}
+
+  def LookupOne(self, module, offset):
+    if (module, offset) not in self._cache:
+      self._Resolve(module, [offset])
+    return self._cache[(module, offset)]
+
+  def Close(self):
+    for process in self._processes.values():
+      process.Close()
+    self._processes = {}
+    if self._disk_cache:
+      self._disk_cache.Close()
+
+
+def RenderFrame(symbols):
+  location = symbols[0][1] if symbols else '??:0'
+  return f'    {os.path.basename(location)}'
+
 
 def SymbolizeLinez(file):
-  matcher = r'#\d+ 0x[a-f0-9]+  \(([\/A-Za-z\.0-8\-_]+)\.so\+0x([a-f0-9]+).+'
   with open(file) as f:
-    for line in f.readlines():
-      while line and line[-1] == '\n':
-        line = line[:-1]
-      m = re.match(matcher, line.strip())
-      if not m:
-        print(line)
-        continue
-      file, address = m.groups()
-      value = librun.OutputOrError(f'addr2line -e {file}.so 0x{address}')
-      repl = f'{file}.so+0x{address}'
-      line = line.replace(repl, value)
-      print(f'    {os.path.basename(value)}')
-      #while line and line[-1] == '\n':
-      #  line = line[:-1]
-      #print(line)
+    lines = [line.rstrip('\n') for line in f]
+  matches = [FRAME.match(line.strip()) for line in lines]
+  frames = [(f'{m.group(1)}.so', m.group(2)) for m in matches if m]
+  symbolizer = Symbolizer(GetSymbolCache())
+  try:
+    symbols = symbolizer.Lookup(frames)
+  finally:
+    symbolizer.Close()
+  for line, m in zip(lines, matches):
+    if not m:
+      print(line)
+      continue
+    print(RenderFrame(symbols[(f'{m.group(1)}.so', m.group(2))]))
+
+
+def FollowLines(f, follow=False):
+  """Yields lines from |f|, waiting for more at EOF if |follow| is set."""
+  while True:
+    line = f.readline()
+    if line:
+      yield line.rstrip('\n')
+    elif follow:
+      time.sleep(0.1)
+    else:
+      return
+
+
+def SymbolizeStream(lines, jobs=8, backlog=1024):
+  """Symbolizes |lines| as they arrive, printing them in their original order.
+
+  Frames are looked up concurrently on |jobs| threads, while at most
+  |backlog| lines are buffered waiting for an earlier frame to resolve.
+  """
+  symbolizer = Symbolizer(GetSymbolCache())
+  pending = queue.Queue(maxsize=backlog)
+
+  def _Symbolize(m):
+    # A failed lookup must still resolve, or the printer would stop and
+    # leave the reader blocked on a full queue.
+    try:
+      symbols = symbolizer.LookupOne(f'{m.group(1)}.so', m.group(2))
+    except (OSError, ValueError):
+      symbols = []
+    return RenderFrame(symbols)
+
+  def _PrintInOrder():
+    while (result := pending.get()) is not None:
+      print(result.result(), flush=True)
+
+  printer = threading.Thread(target=_PrintInOrder)
+  printer.start()
+  with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+    try:
+      for line in lines:
+        m = FRAME.match(line.strip())
+        if m:
+          pending.put(pool.submit(_Symbolize, m))
+        else:
+          done = futures.Future()
+          done.set_result(line)
+          pending.put(done)
+    finally:
+      pending.put(None)
+      printer.join()
+  symbolizer.Close()
+
+
+def main(args):
+  follow = '--follow' in args
+  paths = [a for a in args if a != '--follow']
+  if paths and paths[0] != '-' and not follow:
+    return SymbolizeLinez(paths[0])
+  if not paths or paths[0] == '-':
+    return SymbolizeStream(FollowLines(sys.stdin))
+  with open(paths[0]) as f:
+    SymbolizeStream(FollowLines(f, follow=True))
 
 
 if __name__ == '__main__':
-  SymbolizeLinez(sys.argv[1])
+  main(sys.argv[1:])